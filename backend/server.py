@@ -1,28 +1,61 @@
-from fastapi import FastAPI, APIRouter, HTTPException, Depends, UploadFile, File
+import time
+# Cold start timing starts before any other import
+MODULE_IMPORT_STARTED = time.perf_counter()
+
+from fastapi import FastAPI, APIRouter, HTTPException, Depends, UploadFile, File, Request
 from fastapi.security import HTTPBearer, HTTPAuthorizationCredentials
-from fastapi.responses import StreamingResponse
+from fastapi.responses import StreamingResponse, Response
 from dotenv import load_dotenv
 from starlette.middleware.cors import CORSMiddleware
 from motor.motor_asyncio import AsyncIOMotorClient
+from pymongo import UpdateOne, ReplaceOne, ReturnDocument
+from pymongo.errors import OperationFailure, DuplicateKeyError
+from pymongo.read_preferences import SecondaryPreferred
 import os
 import logging
 from pathlib import Path
 from pydantic import BaseModel, Field
-from typing import List, Optional, Dict, Any
+from typing import List, Optional, Dict, Any, Callable
+from contextvars import ContextVar
+from concurrent.futures import ProcessPoolExecutor
+from collections import OrderedDict
+from functools import lru_cache
 import uuid
-from datetime import datetime, timedelta
+import asyncio
+import random
+import heapq
+import base64
+import json
+from datetime import datetime, timedelta, timezone
+from zoneinfo import ZoneInfo
+from decimal import Decimal, ROUND_HALF_UP
 import jwt
-import pandas as pd
+import re
+from passlib.hash import pbkdf2_sha256
+from contextlib import asynccontextmanager
 import io
 import csv
+import secrets
+import zlib
+
+MODULE_IMPORTS_FINISHED = time.perf_counter()
 
 ROOT_DIR = Path(__file__).parent
 load_dotenv(ROOT_DIR / '.env')
 
 # MongoDB connection
 mongo_url = os.environ['MONGO_URL']
-client = AsyncIOMotorClient(mongo_url)
-db = client[os.environ['DB_NAME']]
+# Workers keep a few connections open so the first request after a cold start
+# or a quiet period does not pay for connection setup and authentication
+MONGO_MIN_POOL_SIZE = int(os.environ.get("MONGO_MIN_POOL_SIZE", "4"))
+client = AsyncIOMotorClient(mongo_url, minPoolSize=MONGO_MIN_POOL_SIZE)
+DB_NAME = os.environ['DB_NAME']
+db = client[DB_NAME]
+# Reporting reads can be sent to a separate analytics deployment or node
+ANALYTICS_MONGO_URL = os.environ.get("ANALYTICS_MONGO_URL")
+analytics_client = (
+    AsyncIOMotorClient(ANALYTICS_MONGO_URL, minPoolSize=MONGO_MIN_POOL_SIZE) if ANALYTICS_MONGO_URL else client
+)
 
 # Create the main app without a prefix
 app = FastAPI()
@@ -33,10 +66,113 @@ api_router = APIRouter(prefix="/api")
 security = HTTPBearer()
 
 # JWT Configuration
-SECRET_KEY = "shop_billing_secret_key_2025"
+# Tokens carry the shop and role every request is authorised by, so the signing
+# key must never be in source; the server refuses to start without one
+SECRET_KEY = os.environ['SECRET_KEY']
 ALGORITHM = "HS256"
 ACCESS_TOKEN_EXPIRE_MINUTES = 1440  # 24 hours
 
+# Tenancy configuration
+# "shared": all shops in one database, every row tagged with shop_id
+# "database": one database per shop; the default shop keeps DB_NAME
+# "sharded": shared layout with collections sharded on a shop_id-led key
+TENANCY_MODE = os.environ.get("TENANCY_MODE", "shared")
+TENANCY_MODES = ("shared", "database", "sharded")
+if TENANCY_MODE not in TENANCY_MODES:
+    raise RuntimeError(f"TENANCY_MODE must be one of: {', '.join(TENANCY_MODES)}")
+# Shop that owns data written before tenancy and the bootstrap superadmin
+DEFAULT_SHOP_ID = os.environ.get("DEFAULT_SHOP_ID", "main")
+SHOP_CACHE_TTL = float(os.environ.get("SHOP_CACHE_TTL", "60"))
+# First login for an empty users collection; unset, the bootstrap is disabled
+BOOTSTRAP_ADMIN_USERNAME = os.environ.get("BOOTSTRAP_ADMIN_USERNAME")
+BOOTSTRAP_ADMIN_PASSWORD = os.environ.get("BOOTSTRAP_ADMIN_PASSWORD")
+
+# Read routing configuration
+# Each route reads through a read class: "primary" for checkout, payments and
+# anything read back right after a write, "reporting" for heavy reports that
+# may lag the primary by up to REPORTING_MAX_STALENESS seconds
+READ_CLASSES = ("primary", "reporting")
+# MongoDB rejects a max staleness below 90 seconds
+REPORTING_MAX_STALENESS = max(int(os.environ.get("REPORTING_MAX_STALENESS", "120")), 90)
+
+# Archive configuration
+ARCHIVE_AFTER_DAYS = int(os.environ.get("ARCHIVE_AFTER_DAYS", "365"))
+ARCHIVE_BATCH_SIZE = int(os.environ.get("ARCHIVE_BATCH_SIZE", "1000"))
+# How long a worker may use its cached archive layout before reloading it
+ARCHIVE_STATE_TTL = float(os.environ.get("ARCHIVE_STATE_TTL", "60"))
+
+# Stock configuration
+# When enabled, sales that would take an item's stock below zero are rejected
+STOCK_ENFORCE_NON_NEGATIVE = os.environ.get("STOCK_ENFORCE_NON_NEGATIVE", "0") == "1"
+LOW_STOCK_THRESHOLD = int(os.environ.get("LOW_STOCK_THRESHOLD", "5"))
+
+# Startup configuration
+# "fast" starts serving once the connection pool and item caches are warm and
+# runs index creation and backfills in the background, but only when the stored
+# schema version shows a previous boot already finished them; "full" always waits
+STARTUP_MODE = os.environ.get("STARTUP_MODE", "fast")
+# Bump whenever startup maintenance gains a step that must finish before traffic
+SCHEMA_VERSION = 1
+# Upper bound on how long a worker keeps its copy of a shop's item catalog;
+# catalog edits on any worker invalidate every copy through a shared version
+ITEM_CACHE_TTL = float(os.environ.get("ITEM_CACHE_TTL", "30"))
+
+# Shop time zone used for day/week/month boundaries and chart buckets
+SHOP_TIMEZONE = os.environ.get("SHOP_TIMEZONE", "UTC")
+SHOP_TZ = ZoneInfo(SHOP_TIMEZONE)
+TIMESERIES_GRANULARITIES = ("hour", "day", "week", "month")
+TIMESERIES_MAX_BUCKETS = int(os.environ.get("TIMESERIES_MAX_BUCKETS", "10000"))
+
+# Query audit configuration
+QUERY_AUDIT_ENABLED = os.environ.get("QUERY_AUDIT", "0") == "1"
+QUERY_AUDIT_SAMPLE_RATE = float(os.environ.get("QUERY_AUDIT_SAMPLE_RATE", "0.1"))
+QUERY_AUDIT_MAX_ENTRIES = int(os.environ.get("QUERY_AUDIT_MAX_ENTRIES", "500"))
+# Routes on the checkout/credit path that must always be served from an index
+HOT_ROUTES = {
+    "get_items", "search_items", "create_bill", "get_bill", "update_bill",
+    "add_payment", "get_credit_customers", "get_customer_payments", "get_analytics_stats",
+}
+
+# Background job configuration
+JOB_WORKERS = int(os.environ.get("JOB_WORKERS", "2"))
+JOB_BATCH_SIZE = int(os.environ.get("JOB_BATCH_SIZE", "500"))
+# A queued or running job whose worker has not renewed its lease for this many
+# seconds is treated as lost (worker crashed or was killed) and marked failed
+JOB_LEASE_SECONDS = int(os.environ.get("JOB_LEASE_SECONDS", "60"))
+# Maximum number of jobs of each type running at once in this worker
+JOB_CONCURRENCY = {
+    "import_items": 1,
+    "export_items": 2,
+    "migrate_money": 1,
+    "archive_bills": 1,
+}
+
+# Invoice rendering configuration
+SHOP_NAME = os.environ.get("SHOP_NAME", "Shop Billing")
+PDF_WORKERS = int(os.environ.get("PDF_WORKERS", str(os.cpu_count() or 2)))
+PDF_CACHE_SIZE = int(os.environ.get("PDF_CACHE_SIZE", "2000"))
+PDF_BATCH_LIMIT = int(os.environ.get("PDF_BATCH_LIMIT", "1000"))
+
+# Credit aging configuration
+AGING_DEFAULT_EDGES = [30, 60, 90]
+AGING_PAGE_LIMIT = 500
+
+# Credit statement configuration
+STATEMENT_PAGE_LIMIT = int(os.environ.get("STATEMENT_PAGE_LIMIT", "1000"))
+STATEMENT_MONEY_FIELDS = ("debit", "credit", "balance")
+
+# Live feed configuration
+LIVE_POLL_INTERVAL = float(os.environ.get("LIVE_POLL_INTERVAL", "2"))
+LIVE_RESYNC_INTERVAL = float(os.environ.get("LIVE_RESYNC_INTERVAL", "60"))
+# Bill updates and deletes need a full recompute; a burst of them within this
+# many seconds is folded into one
+LIVE_REFRESH_INTERVAL = float(os.environ.get("LIVE_REFRESH_INTERVAL", "2"))
+LIVE_HEARTBEAT_INTERVAL = float(os.environ.get("LIVE_HEARTBEAT_INTERVAL", "15"))
+LIVE_QUEUE_SIZE = 100
+# EventSource puts its token in the URL, where proxies and access logs keep it,
+# so streams authenticate with a short-lived token that only opens streams
+LIVE_STREAM_TOKEN_SECONDS = int(os.environ.get("LIVE_STREAM_TOKEN_SECONDS", "60"))
+
 # Models
 class LoginRequest(BaseModel):
     username: str
@@ -47,12 +183,25 @@ class LoginResponse(BaseModel):
     token_type: str
     user: Dict[str, Any]
 
+class CurrentUser(BaseModel):
+    username: str
+    shop_id: str
+    role: str = "staff"  # "staff", "admin" (own shop) or "superadmin" (all shops)
+
+class UserCreate(BaseModel):
+    username: str
+    password: str
+    shop_id: str
+    shop_name: Optional[str] = None
+    role: str = "staff"
+
 class Item(BaseModel):
     id: str = Field(default_factory=lambda: str(uuid.uuid4()))
     name: str
     cost_price: float
     customer_price: float
     carpenter_price: float
+    stock_quantity: int = 0
     created_at: datetime = Field(default_factory=datetime.utcnow)
     updated_at: datetime = Field(default_factory=datetime.utcnow)
 
@@ -61,6 +210,7 @@ class ItemCreate(BaseModel):
     cost_price: float
     customer_price: float
     carpenter_price: float
+    stock_quantity: int = 0
 
 class ItemUpdate(BaseModel):
     name: Optional[str] = None
@@ -68,6 +218,19 @@ class ItemUpdate(BaseModel):
     customer_price: Optional[float] = None
     carpenter_price: Optional[float] = None
 
+class StockMovement(BaseModel):
+    id: str = Field(default_factory=lambda: str(uuid.uuid4()))
+    item_id: str
+    change: int
+    reason: str  # "sale", "sale_reversal", "bill_update", "bill_update_reversal", "bill_delete", "import" or "adjustment"
+    bill_id: Optional[str] = None
+    notes: Optional[str] = None
+    created_at: datetime = Field(default_factory=datetime.utcnow)
+
+class StockAdjustment(BaseModel):
+    change: int
+    notes: Optional[str] = None
+
 class BillItem(BaseModel):
     item_id: str
     item_name: str
@@ -134,6 +297,85 @@ class CreditCustomer(BaseModel):
     bill_count: int
     bills: List[str]  # List of bill IDs
 
+class StatementEntry(BaseModel):
+    date: datetime
+    entry_type: str  # "bill" or "payment"
+    id: str
+    bill_id: str
+    reference: str
+    debit: float
+    credit: float
+    balance: float
+
+class StatementPage(BaseModel):
+    customer_phone: str
+    opening_balance: float
+    closing_balance: float
+    entries: List[StatementEntry]
+    next_cursor: Optional[str] = None
+
+class AgingCustomer(BaseModel):
+    customer_phone: Optional[str] = None
+    customer_name: str
+    total: float
+    bill_count: int
+    oldest_days: int
+    buckets: Dict[str, float]
+
+class AgingReport(BaseModel):
+    as_of: datetime
+    edges: List[int]
+    bucket_labels: List[str]
+    totals: Dict[str, float]
+    bill_counts: Dict[str, int]
+    total_outstanding: float
+    customers: List[AgingCustomer]
+    customer_count: int
+    skip: int
+    limit: int
+
+class TimeSeriesPoint(BaseModel):
+    bucket_start: datetime
+    label: str
+    sales: float
+    profit: float
+    bill_count: int
+    paid_amount: float
+    paid_count: int
+    credit_amount: float
+    credit_count: int
+
+class TimeSeriesResponse(BaseModel):
+    granularity: str
+    timezone: str
+    start_date: datetime
+    end_date: datetime
+    points: List[TimeSeriesPoint]
+
+class Job(BaseModel):
+    id: str = Field(default_factory=lambda: str(uuid.uuid4()))
+    job_type: str
+    status: str = "queued"  # "queued", "running", "completed", "failed" or "cancelled"
+    params: Dict[str, Any] = {}
+    progress: float = 0
+    message: Optional[str] = None
+    result: Optional[Dict[str, Any]] = None
+    error: Optional[str] = None
+    output_filename: Optional[str] = None
+    output_media_type: Optional[str] = None
+    cancel_requested: bool = False
+    shop_id: str
+    created_by: str
+    created_at: datetime = Field(default_factory=datetime.utcnow)
+    started_at: Optional[datetime] = None
+    finished_at: Optional[datetime] = None
+    locked_until: Optional[datetime] = None
+
+class InvoiceBatchRequest(BaseModel):
+    bill_ids: Optional[List[str]] = None
+    customer_phone: Optional[str] = None
+    bill_type: Optional[str] = None
+
 class AnalyticsQuery(BaseModel):
     start_date: Optional[datetime] = None
     end_date: Optional[datetime] = None
@@ -150,24 +392,183 @@ def create_access_token(data: dict, expires_delta: Optional[timedelta] = None):
     encoded_jwt = jwt.encode(to_encode, SECRET_KEY, algorithm=ALGORITHM)
     return encoded_jwt
 
-def verify_token(credentials: HTTPAuthorizationCredentials = Depends(security)):
+def decode_access_token(token: str, scope: Optional[str] = None) -> CurrentUser:
     try:
-        payload = jwt.decode(credentials.credentials, SECRET_KEY, algorithms=[ALGORITHM])
+        payload = jwt.decode(token, SECRET_KEY, algorithms=[ALGORITHM])
         username: str = payload.get("sub")
-        if username is None:
+        # Scoped tokens (such as stream tokens) are only accepted where that scope is expected
+        if username is None or payload.get("scope") != scope:
             raise HTTPException(status_code=401, detail="Invalid authentication credentials")
-        return username
+        # Tokens issued before tenancy carry no shop and belong to the default shop
+        return CurrentUser(
+            username=username,
+            shop_id=payload.get("shop_id", DEFAULT_SHOP_ID),
+            role=payload.get("role", "staff"),
+        )
     except jwt.PyJWTError:
         raise HTTPException(status_code=401, detail="Invalid authentication credentials")
 
-def verify_credentials(username: str, password: str):
-    # Hardcoded credentials as per requirements
-    if username == "VVR" and password == "Vvr9704585785":
-        return True
-    return False
+def verify_token(credentials: HTTPAuthorizationCredentials = Depends(security)) -> CurrentUser:
+    return decode_access_token(credentials.credentials)
+
+def verify_stream_token(token: str) -> CurrentUser:
+    # EventSource cannot send an Authorization header, so streams take a
+    # short-lived stream token from POST /api/live/token as a query parameter
+    return decode_access_token(token, scope="stream")
+
+def verify_admin(current_user: CurrentUser = Depends(verify_token)) -> CurrentUser:
+    if current_user.role not in ("admin", "superadmin"):
+        raise HTTPException(status_code=403, detail="Admin access required")
+    return current_user
+
+def verify_superadmin(current_user: CurrentUser = Depends(verify_token)) -> CurrentUser:
+    # Shop admins manage their own shop; anything spanning shops needs a superadmin
+    if current_user.role != "superadmin":
+        raise HTTPException(status_code=403, detail="Superadmin access required")
+    return current_user
+
+async def verify_credentials(username: str, password: str) -> Optional[CurrentUser]:
+    user = await db.users.find_one({"username": username})
+    if user:
+        # Hash verification is deliberately slow, so keep it off the event loop
+        if await asyncio.to_thread(pbkdf2_sha256.verify, password, user["password_hash"]):
+            return CurrentUser(username=user["username"], shop_id=user["shop_id"], role=user.get("role", "staff"))
+        return None
+    # Bootstrap only: while no user exists, the configured bootstrap login is
+    # accepted once and stored as the first superadmin; from then on every login,
+    # including this one, is checked against the users collection alone
+    if (
+        BOOTSTRAP_ADMIN_USERNAME and BOOTSTRAP_ADMIN_PASSWORD
+        and secrets.compare_digest(username, BOOTSTRAP_ADMIN_USERNAME)
+        and secrets.compare_digest(password, BOOTSTRAP_ADMIN_PASSWORD)
+    ):
+        if await db.users.find_one({}, {"_id": 1}) is None:
+            bootstrap_user = CurrentUser(username=username, shop_id=DEFAULT_SHOP_ID, role="superadmin")
+            try:
+                await store_user(bootstrap_user, password)
+            except DuplicateKeyError:
+                return None
+            await register_shop(DEFAULT_SHOP_ID)
+            return bootstrap_user
+    return None
+
+# Shop tenancy
+# Every request acts for one shop. Shop.scope() adds the shop_id that every
+# tenant query is filtered by and every tenant document carries, so the same
+# queries work whether shops share a database or each have their own.
+SHOP_ID_PATTERN = re.compile(r"^[a-z0-9][a-z0-9_-]{0,31}$")
+_read_databases: Dict[tuple, Any] = {}
+_shop_names: Dict[str, tuple] = {}
+
+def read_database(database_name: str, read_class: str):
+    key = (database_name, read_class)
+    if key not in _read_databases:
+        if read_class == "primary":
+            database = client[database_name]
+        elif ANALYTICS_MONGO_URL:
+            # A dedicated analytics URL carries its own readPreference and tags
+            database = analytics_client[database_name]
+        else:
+            database = client.get_database(
+                database_name, read_preference=SecondaryPreferred(max_staleness=REPORTING_MAX_STALENESS)
+            )
+        _read_databases[key] = database
+    return _read_databases[key]
+
+def shop_database(shop_id: str, read_class: str = "primary"):
+    if TENANCY_MODE != "database" or shop_id == DEFAULT_SHOP_ID:
+        if read_class == "primary":
+            return db
+        return read_database(DB_NAME, read_class)
+    return read_database(f"{DB_NAME}_{shop_id}", read_class)
+
+class Shop:
+    def __init__(self, shop_id: str, user: Optional[str] = None, read_class: str = "primary"):
+        self.id = shop_id
+        self.user = user
+        self.read_class = read_class
+        self.db = shop_database(shop_id, read_class)
+
+    def scope(self, query: Optional[Dict[str, Any]] = None) -> Dict[str, Any]:
+        scoped = {"shop_id": self.id}
+        if query:
+            scoped.update(query)
+        return scoped
+
+def shop_reads(read_class: str) -> Callable:
+    """Build the route dependency that resolves the caller's shop with reads routed by read class."""
+    if read_class not in READ_CLASSES:
+        raise ValueError(f"Unknown read class: {read_class}")
+
+    if read_class == "primary":
+        def resolve(current_user: CurrentUser = Depends(verify_token)) -> Shop:
+            return Shop(current_user.shop_id, current_user.username, read_class)
+        return resolve
+
+    def resolve_lagging(fresh: bool = False, current_user: CurrentUser = Depends(verify_token)) -> Shop:
+        # A client re-reading right after its own write passes fresh=1 so the
+        # read cannot come from a secondary that has not seen the write yet
+        return Shop(current_user.shop_id, current_user.username, "primary" if fresh else read_class)
+    return resolve_lagging
+
+get_shop = shop_reads("primary")
+get_reporting_shop = shop_reads("reporting")
+
+def get_stream_shop(current_user: CurrentUser = Depends(verify_stream_token)) -> Shop:
+    return Shop(current_user.shop_id, current_user.username)
+
+def get_admin_shop(current_user: CurrentUser = Depends(verify_admin)) -> Shop:
+    return Shop(current_user.shop_id, current_user.username)
+
+async def tenant_databases() -> List[Any]:
+    # Maintenance work (backfills, migrations, indexes) must visit every shop's data
+    if TENANCY_MODE != "database":
+        return [db]
+    shop_ids = await db.shops.distinct("shop_id")
+    return [db] + [shop_database(shop_id) for shop_id in shop_ids if shop_id != DEFAULT_SHOP_ID]
+
+async def store_user(user: CurrentUser, password: str):
+    password_hash = await asyncio.to_thread(pbkdf2_sha256.hash, password)
+    await db.users.insert_one({
+        "username": user.username,
+        "password_hash": password_hash,
+        "shop_id": user.shop_id,
+        "role": user.role,
+        "created_at": datetime.utcnow(),
+    })
+
+async def register_shop(shop_id: str, name: Optional[str] = None):
+    shop_update = {"$setOnInsert": {"shop_id": shop_id, "created_at": datetime.utcnow()}}
+    if name:
+        shop_update["$set"] = {"name": name}
+    result = await db.shops.update_one({"shop_id": shop_id}, shop_update, upsert=True)
+    if result.upserted_id is not None:
+        await create_indexes_from_specs(shop_database(shop_id), SHOP_INDEX_SPECS)
+        await enable_bill_pre_images(shop_database(shop_id))
+    _shop_names.pop(shop_id, None)
+
+async def get_shop_name(shop: Shop) -> str:
+    cached = _shop_names.get(shop.id)
+    if cached and time.monotonic() - cached[1] < SHOP_CACHE_TTL:
+        return cached[0]
+    doc = await db.shops.find_one({"shop_id": shop.id}, {"name": 1})
+    name = (doc or {}).get("name") or SHOP_NAME
+    _shop_names[shop.id] = (name, time.monotonic())
+    return name
+
+def shop_now() -> datetime:
+    # Naive wall-clock time in the shop's time zone
+    return datetime.now(SHOP_TZ).replace(tzinfo=None)
+
+def shop_to_utc(local: datetime) -> datetime:
+    # Dates are stored as naive UTC, so convert local boundaries back before querying
+    return local.replace(tzinfo=SHOP_TZ).astimezone(timezone.utc).replace(tzinfo=None)
+
+def utc_to_shop(value: datetime) -> datetime:
+    return value.replace(tzinfo=timezone.utc).astimezone(SHOP_TZ).replace(tzinfo=None)
 
 def get_date_range(period: str, start_date: Optional[datetime] = None, end_date: Optional[datetime] = None):
-    now = datetime.utcnow()
+    now = shop_now()
     
     if period == "custom" and start_date and end_date:
         return start_date, end_date
@@ -192,12 +593,1718 @@ def get_date_range(period: str, start_date: Optional[datetime] = None, end_date:
         start = datetime(now.year, now.month, now.day)
         end = start + timedelta(days=1)
     
-    return start, end
+    return shop_to_utc(start), shop_to_utc(end)
+
+def truncate_local(value: datetime, granularity: str) -> datetime:
+    if granularity == "hour":
+        return value.replace(minute=0, second=0, microsecond=0)
+    day = datetime(value.year, value.month, value.day)
+    if granularity == "week":
+        return day - timedelta(days=day.weekday())
+    if granularity == "month":
+        return day.replace(day=1)
+    return day
+
+def next_local_bucket(value: datetime, granularity: str) -> datetime:
+    if granularity == "hour":
+        return value + timedelta(hours=1)
+    if granularity == "week":
+        return value + timedelta(days=7)
+    if granularity == "month":
+        return datetime(value.year + value.month // 12, value.month % 12 + 1, 1)
+    return value + timedelta(days=1)
+
+def iterate_buckets(start: datetime, end: datetime, granularity: str) -> List[datetime]:
+    """Local bucket starts covering the UTC range [start, end)."""
+    buckets = []
+    local = truncate_local(utc_to_shop(start), granularity)
+    local_end = utc_to_shop(end)
+    while local < local_end:
+        buckets.append(local)
+        if len(buckets) > TIMESERIES_MAX_BUCKETS:
+            raise HTTPException(status_code=400, detail=f"Range spans more than {TIMESERIES_MAX_BUCKETS} buckets")
+        local = next_local_bucket(local, granularity)
+    return buckets
+
+# Money handling
+# Amounts are stored as integer minor units (paise) so balances and sums are
+# exact. The API still exchanges rupee floats and converts at the boundary.
+MONEY_SCALE = 100
+ITEM_MONEY_FIELDS = ("cost_price", "customer_price", "carpenter_price")
+BILL_MONEY_FIELDS = ("total_amount", "amount_paid", "profit", "remaining_balance")
+BILL_ITEM_MONEY_FIELDS = ("cost_price", "sale_price", "subtotal", "profit")
+PAYMENT_MONEY_FIELDS = ("amount",)
+
+def to_minor(amount: Optional[float]) -> Optional[int]:
+    if amount is None:
+        return None
+    return int((Decimal(str(amount)) * MONEY_SCALE).to_integral_value(rounding=ROUND_HALF_UP))
+
+def stored_minor(value: Any) -> Optional[int]:
+    # Documents written before the fixed-point migration hold rupee doubles
+    if isinstance(value, float):
+        return to_minor(value)
+    return value
+
+def from_minor(value: Any) -> Optional[float]:
+    if value is None or isinstance(value, float):
+        return value
+    return value / MONEY_SCALE
+
+def minor_expr(field: str) -> Dict[str, Any]:
+    # Aggregation counterpart of stored_minor: until the migration finishes a
+    # group can mix rupee doubles with paise ints, so scale the doubles first
+    return {
+        "$cond": [
+            {"$eq": [{"$type": f"${field}"}, "double"]},
+            {"$toLong": {"$round": [{"$multiply": [f"${field}", MONEY_SCALE]}, 0]}},
+            f"${field}",
+        ]
+    }
+
+def _convert_money(doc: Dict[str, Any], fields: tuple, convert: Callable) -> Dict[str, Any]:
+    doc = dict(doc)
+    for field in fields:
+        if field in doc:
+            doc[field] = convert(doc[field])
+    return doc
+
+def item_to_db(item: Dict[str, Any]) -> Dict[str, Any]:
+    return _convert_money(item, ITEM_MONEY_FIELDS, to_minor)
+
+def item_from_db(doc: Dict[str, Any]) -> Dict[str, Any]:
+    return _convert_money(doc, ITEM_MONEY_FIELDS, from_minor)
+
+def bill_to_db(bill: Dict[str, Any]) -> Dict[str, Any]:
+    doc = _convert_money(bill, BILL_MONEY_FIELDS, to_minor)
+    if "items" in doc:
+        doc["items"] = [_convert_money(item, BILL_ITEM_MONEY_FIELDS, to_minor) for item in doc["items"]]
+    return doc
+
+def bill_from_db(doc: Dict[str, Any]) -> Dict[str, Any]:
+    bill = _convert_money(doc, BILL_MONEY_FIELDS, from_minor)
+    if "items" in bill:
+        bill["items"] = [_convert_money(item, BILL_ITEM_MONEY_FIELDS, from_minor) for item in bill["items"]]
+    return bill
+
+def payment_to_db(payment: Dict[str, Any]) -> Dict[str, Any]:
+    return _convert_money(payment, PAYMENT_MONEY_FIELDS, to_minor)
+
+def payment_from_db(doc: Dict[str, Any]) -> Dict[str, Any]:
+    return _convert_money(doc, PAYMENT_MONEY_FIELDS, from_minor)
+
+# Item catalog cache
+# The checkout screen loads the whole catalog, so each worker keeps a per-shop
+# copy of the names and prices. A catalog version stored with the shop's
+# counters is bumped by every catalog edit and checked on each read, so no
+# worker serves a price another worker has changed. Stock moves with every
+# sale, so it is never cached: it is read live and merged in.
+item_cache: Dict[str, Dict[str, Any]] = {}
+
+def _catalog_version_id(shop: Shop) -> str:
+    return f"{shop.id}:catalog"
+
+async def get_cached_items(shop: Shop) -> List[Item]:
+    marker = await shop.db.counters.find_one({"_id": _catalog_version_id(shop)}, {"version": 1})
+    version = marker["version"] if marker else 0
+    cached = item_cache.get(shop.id)
+    if cached is None or cached["version"] != version or time.monotonic() - cached["loaded_at"] >= ITEM_CACHE_TTL:
+        # The version is read before the catalog, so an edit that lands during
+        # the load leaves this copy one version behind and the next read reloads
+        audit_find("get_items", shop.db.items, shop.scope(), sort={"name": 1}, limit=1000)
+        docs = await shop.db.items.find(shop.scope()).sort("name", 1).to_list(1000)
+        cached = {"items": [item_from_db(doc) for doc in docs], "version": version, "loaded_at": time.monotonic()}
+        item_cache[shop.id] = cached
+        stock = {doc["id"]: doc.get("stock_quantity", 0) for doc in docs}
+    else:
+        docs = await shop.db.items.find(shop.scope(), {"_id": 0, "id": 1, "stock_quantity": 1}).to_list(None)
+        stock = {doc["id"]: doc.get("stock_quantity", 0) for doc in docs}
+    return [Item(**{**item, "stock_quantity": stock[item["id"]]}) for item in cached["items"] if item["id"] in stock]
+
+async def invalidate_item_cache(shop: Shop):
+    item_cache.pop(shop.id, None)
+    await shop_database(shop.id).counters.update_one(
+        {"_id": _catalog_version_id(shop)},
+        {"$inc": {"version": 1}, "$setOnInsert": {"shop_id": shop.id}},
+        upsert=True,
+    )
+
+# Stock tracking
+# Every stock change for a request is applied with one ordered bulk_write of
+# $inc operations, so checkout cost does not grow with the number of lines.
+# Each write also tags the item with a transaction id, which lets a guarded
+# batch that fell short find and undo exactly the operations it applied.
+STOCK_TXN_HISTORY = 20
+
+def stock_changes_for_items(items: List[Dict[str, Any]], sign: int) -> Dict[str, int]:
+    changes: Dict[str, int] = {}
+    for item in items:
+        changes[item["item_id"]] = changes.get(item["item_id"], 0) + sign * item["quantity"]
+    return changes
+
+def merge_stock_changes(*changes: Dict[str, int]) -> Dict[str, int]:
+    merged: Dict[str, int] = {}
+    for change in changes:
+        for item_id, quantity in change.items():
+            merged[item_id] = merged.get(item_id, 0) + quantity
+    return merged
+
+async def apply_stock_changes(
+    shop: Shop,
+    changes: Dict[str, int],
+    reason: str,
+    bill_id: Optional[str] = None,
+    notes: Optional[str] = None,
+    guard: bool = STOCK_ENFORCE_NON_NEGATIVE,
+):
+    changes = {item_id: change for item_id, change in changes.items() if change}
+    if not changes:
+        return
+
+    txn = str(uuid.uuid4())
+    operations = []
+    for item_id, change in changes.items():
+        item_filter = shop.scope({"id": item_id})
+        if guard and change < 0:
+            item_filter["stock_quantity"] = {"$gte": -change}
+        operations.append(UpdateOne(item_filter, {
+            "$inc": {"stock_quantity": change},
+            "$push": {"stock_txns": {"$each": [txn], "$slice": -STOCK_TXN_HISTORY}},
+        }))
+    result = await shop.db.items.bulk_write(operations, ordered=True)
+
+    if result.matched_count < len(operations):
+        found = await shop.db.items.find(
+            shop.scope({"id": {"$in": list(changes)}}),
+            {"id": 1, "name": 1, "stock_txns": 1},
+        ).to_list(None)
+        applied = {item["id"] for item in found if txn in item.get("stock_txns", [])}
+        # Lines for deleted items are skipped; only existing items can be short
+        short = [item["name"] for item in found if item["id"] not in applied]
+        if guard and short:
+            await shop.db.items.bulk_write([
+                UpdateOne(shop.scope({"id": item_id}), {"$inc": {"stock_quantity": -changes[item_id]}, "$pull": {"stock_txns": txn}})
+                for item_id in applied
+            ], ordered=True)
+            raise HTTPException(status_code=409, detail=f"Insufficient stock for: {', '.join(short)}")
+        changes = {item_id: change for item_id, change in changes.items() if item_id in applied}
+
+    if changes:
+        now = datetime.utcnow()
+        await shop.db.stock_movements.insert_many([
+            shop.scope(StockMovement(item_id=item_id, change=change, reason=reason, bill_id=bill_id, notes=notes, created_at=now).dict())
+            for item_id, change in changes.items()
+        ])
+
+async def backfill_stock_levels():
+    # Items created before stock tracking need a level for the low-stock index to see them
+    for database in await tenant_databases():
+        await database.items.update_many({"stock_quantity": {"$exists": False}}, {"$set": {"stock_quantity": 0}})
+
+# Collections whose rows belong to a shop; bill archives are matched by prefix
+# The collections that held data before tenancy
+TENANT_COLLECTIONS = ("items", "bills", "payments")
+
+async def backfill_shop_ids() -> int:
+    # Rows written before tenancy all belong to the default shop, whose data
+    # stays in the main database in every tenancy mode
+    backfilled = 0
+    for name in TENANT_COLLECTIONS:
+        result = await db[name].update_many({"shop_id": {"$exists": False}}, {"$set": {"shop_id": DEFAULT_SHOP_ID}})
+        backfilled += result.modified_count
+    return backfilled
+
+# Query plan auditing
+query_audit_forced: ContextVar[bool] = ContextVar("query_audit_forced", default=False)
+query_audit_log: Dict[str, Dict[str, Any]] = {}
+_audit_tasks = set()
+
+def _should_audit() -> bool:
+    if not QUERY_AUDIT_ENABLED:
+        return False
+    return query_audit_forced.get() or random.random() < QUERY_AUDIT_SAMPLE_RATE
+
+def _query_shape(value: Any) -> Any:
+    # Replace literal values with their type so one entry covers every call of a query
+    if isinstance(value, dict):
+        return {k: _query_shape(v) for k, v in value.items()}
+    if isinstance(value, list):
+        return [_query_shape(v) for v in value]
+    return type(value).__name__
+
+def _query_shop_id(value: Any) -> Optional[str]:
+    # Every tenant query carries its shop_id, usually in the first $match
+    if isinstance(value, dict):
+        if isinstance(value.get("shop_id"), str):
+            return value["shop_id"]
+        value = list(value.values())
+    if isinstance(value, list):
+        for item in value:
+            shop_id = _query_shop_id(item)
+            if shop_id is not None:
+                return shop_id
+    return None
+
+def summarize_explain(explain: Dict[str, Any]) -> Dict[str, Any]:
+    stages = set()
+    docs_examined = 0
+    keys_examined = 0
+    returned = 0
+    in_memory_sort = False
+
+    def walk(node):
+        nonlocal docs_examined, keys_examined, returned, in_memory_sort
+        if isinstance(node, dict):
+            if "stage" in node:
+                stages.add(node["stage"])
+            if "$sort" in node:
+                # A $sort left in the aggregation pipeline was not satisfied by an index
+                in_memory_sort = True
+            stats = node.get("executionStats")
+            if isinstance(stats, dict):
+                docs_examined += stats.get("totalDocsExamined", 0)
+                keys_examined += stats.get("totalKeysExamined", 0)
+                returned += stats.get("nReturned", 0)
+            for value in node.values():
+                walk(value)
+        elif isinstance(node, list):
+            for value in node:
+                walk(value)
+
+    walk(explain)
+    return {
+        "stages": sorted(stages),
+        "collscan": "COLLSCAN" in stages,
+        "in_memory_sort": in_memory_sort or "SORT" in stages,
+        "docs_examined": docs_examined,
+        "keys_examined": keys_examined,
+        "returned": returned,
+        "examined_ratio": docs_examined / returned if returned else float(docs_examined),
+    }
+
+def _record_audit(route: str, namespace: str, shop_id: Optional[str], shape: Any, summary: Dict[str, Any]):
+    key = f"{shop_id}:{route}:{namespace}:{shape}"
+    entry = query_audit_log.get(key)
+    if entry is None:
+        if len(query_audit_log) >= QUERY_AUDIT_MAX_ENTRIES:
+            oldest = min(query_audit_log, key=lambda k: query_audit_log[k]["last_seen"])
+            query_audit_log.pop(oldest)
+        entry = {
+            "route": route,
+            "namespace": namespace,
+            "shop_id": shop_id,
+            "query_shape": shape,
+            "hot": route in HOT_ROUTES,
+            "samples": 0,
+            "collscans": 0,
+            "in_memory_sorts": 0,
+            "max_examined_ratio": 0.0,
+        }
+        query_audit_log[key] = entry
+    entry["samples"] += 1
+    entry["collscans"] += int(summary["collscan"])
+    entry["in_memory_sorts"] += int(summary["in_memory_sort"])
+    entry["max_examined_ratio"] = max(entry["max_examined_ratio"], summary["examined_ratio"])
+    entry["last_plan"] = summary
+    entry["last_seen"] = datetime.utcnow()
+
+async def _run_explain(route: str, collection, command: Dict[str, Any], shape: Any):
+    try:
+        # Database.command defaults to the primary; explain where the route reads
+        explain = await collection.database.command(
+            {"explain": command, "verbosity": "executionStats"},
+            read_preference=collection.read_preference,
+        )
+        _record_audit(route, collection.full_name, _query_shop_id(command), shape, summarize_explain(explain))
+    except Exception as e:
+        logger.warning(f"Query audit failed for {route}: {e}")
+
+def _schedule_explain(route: str, collection, command: Dict[str, Any], shape: Any):
+    task = asyncio.create_task(_run_explain(route, collection, command, shape))
+    _audit_tasks.add(task)
+    task.add_done_callback(_audit_tasks.discard)
+
+def audit_find(route: str, collection, filter: Dict[str, Any], sort: Optional[Dict[str, int]] = None, limit: Optional[int] = None):
+    if not _should_audit():
+        return
+    command = {"find": collection.name, "filter": filter}
+    if sort:
+        command["sort"] = sort
+    if limit:
+        command["limit"] = limit
+    _schedule_explain(route, collection, command, _query_shape({"filter": filter, "sort": sort}))
+
+def audit_count(route: str, collection, filter: Dict[str, Any]):
+    if not _should_audit():
+        return
+    command = {"count": collection.name, "query": filter}
+    _schedule_explain(route, collection, command, _query_shape({"count": filter}))
+
+def audit_aggregate(route: str, collection, pipeline: List[Dict[str, Any]]):
+    if not _should_audit():
+        return
+    command = {"aggregate": collection.name, "pipeline": pipeline, "cursor": {}}
+    _schedule_explain(route, collection, command, _query_shape({"pipeline": pipeline}))
+
+# Every tenant index is led by shop_id, so a shop's queries only walk its own
+# slice of each index however many shops share the collection
+SHOP_INDEX_SPECS = {
+    "items": [
+        ([("shop_id", 1), ("id", 1)], {"unique": True}),
+        ([("shop_id", 1), ("name", 1)], {}),
+        ([("shop_id", 1), ("stock_quantity", 1)], {}),
+    ],
+    "bills": [
+        ([("shop_id", 1), ("id", 1)], {"unique": True}),
+        ([("shop_id", 1), ("created_at", -1)], {}),
+        ([("shop_id", 1), ("updated_at", 1)], {}),
+        ([("shop_id", 1), ("bill_type", 1), ("remaining_balance", 1)], {}),
+        ([("shop_id", 1), ("customer_phone", 1), ("bill_type", 1), ("remaining_balance", 1)], {}),
+        ([("shop_id", 1), ("customer_phone", 1), ("bill_type", 1), ("created_at", 1), ("id", 1)], {}),
+    ],
+    "payments": [
+        ([("shop_id", 1), ("id", 1)], {"unique": True}),
+        ([("shop_id", 1), ("customer_phone", 1), ("payment_date", 1), ("id", 1)], {}),
+        ([("shop_id", 1), ("bill_id", 1)], {}),
+        ([("shop_id", 1), ("payment_date", 1)], {}),
+    ],
+    "stock_movements": [
+        ([("shop_id", 1), ("item_id", 1), ("created_at", -1)], {}),
+        ([("shop_id", 1), ("bill_id", 1)], {}),
+    ],
+}
+
+# Collections shared by all shops, always kept in the main database
+GLOBAL_INDEX_SPECS = {
+    "jobs": [
+        ([("id", 1)], {"unique": True}),
+        ([("shop_id", 1), ("created_at", -1)], {}),
+        ([("status", 1), ("locked_until", 1)], {}),
+    ],
+    "users": [
+        ([("username", 1)], {"unique": True}),
+    ],
+    "shops": [
+        ([("shop_id", 1)], {"unique": True}),
+    ],
+}
+
+# Shard keys for TENANCY_MODE=sharded. shop_id leads so every tenant query is
+# targeted at the shards holding that shop; the second field lets the balancer
+# split a large shop into several chunks instead of one unsplittable range.
+# Single-document writes and upserts match on the full key.
+SHARD_KEYS = {
+    "items": {"shop_id": 1, "id": 1},
+    "bills": {"shop_id": 1, "id": 1},
+    "payments": {"shop_id": 1, "id": 1},
+    "stock_movements": {"shop_id": 1, "item_id": 1},
+}
+
+async def create_indexes_from_specs(database, index_specs: Dict[str, list]):
+    for collection_name, specs in index_specs.items():
+        for keys, options in specs:
+            try:
+                await database[collection_name].create_index(keys, **options)
+            except Exception as e:
+                logger.error(f"Failed to create index {keys} on {collection_name}: {e}")
+
+async def enable_bill_pre_images(database):
+    # Live feeds need a deleted bill's shop_id to route the delete to one shop
+    try:
+        await database.command("collMod", "bills", changeStreamPreAndPostImages={"enabled": True})
+    except OperationFailure as e:
+        logger.warning(f"Change stream pre-images unavailable on {database.name}.bills: {e}")
+
+async def shard_collections():
+    try:
+        await client.admin.command("enableSharding", DB_NAME)
+    except OperationFailure as e:
+        logger.error(f"Failed to enable sharding on {DB_NAME}: {e}")
+        return
+    for collection_name, key in SHARD_KEYS.items():
+        try:
+            await client.admin.command("shardCollection", f"{DB_NAME}.{collection_name}", key=key)
+        except OperationFailure as e:
+            logger.error(f"Failed to shard {collection_name}: {e}")
+
+async def ensure_indexes():
+    await create_indexes_from_specs(db, GLOBAL_INDEX_SPECS)
+    for database in await tenant_databases():
+        await create_indexes_from_specs(database, SHOP_INDEX_SPECS)
+        await enable_bill_pre_images(database)
+    if TENANCY_MODE == "sharded":
+        await shard_collections()
+
+# Background jobs
+JOB_HANDLERS: Dict[str, Callable] = {}
+JOB_READ_CLASSES: Dict[str, str] = {}
+JOB_FINAL_STATUSES = {"completed", "failed", "cancelled"}
+running_jobs: Dict[str, asyncio.Task] = {}
+_job_semaphores: Dict[str, asyncio.Semaphore] = {}
+_job_executor: Optional[ProcessPoolExecutor] = None
+
+class JobCancelled(Exception):
+    pass
+
+def job_handler(job_type: str, read_class: str = "primary"):
+    def register(func: Callable):
+        JOB_HANDLERS[job_type] = func
+        JOB_READ_CLASSES[job_type] = read_class
+        return func
+    return register
+
+def get_job_executor() -> ProcessPoolExecutor:
+    global _job_executor
+    if _job_executor is None:
+        _job_executor = ProcessPoolExecutor(max_workers=JOB_WORKERS)
+    return _job_executor
+
+async def run_in_job_pool(func: Callable, *args):
+    # CPU-bound work (pandas parsing, CSV rendering) must never run on the event loop
+    loop = asyncio.get_running_loop()
+    return await loop.run_in_executor(get_job_executor(), func, *args)
+
+class JobContext:
+    def __init__(self, job_id: str, shop: Shop):
+        self.job_id = job_id
+        self.shop = shop
+
+    async def report(self, progress: float, message: Optional[str] = None):
+        # Progress updates double as cancellation checkpoints, so a cancel
+        # issued through any API worker stops the job at its next batch
+        job = await db.jobs.find_one_and_update(
+            {"id": self.job_id},
+            {"$set": {"progress": round(progress, 4), "message": message}},
+            projection={"cancel_requested": 1},
+        )
+        if job and job.get("cancel_requested"):
+            raise JobCancelled()
+
+    async def save_output(self, filename: str, media_type: str, data: bytes):
+        await db.jobs.update_one(
+            {"id": self.job_id},
+            {"$set": {"output_filename": filename, "output_media_type": media_type, "output_data": data}},
+        )
+
+async def _finish_job(job_id: str, status: str, **fields):
+    fields.update({"status": status, "finished_at": datetime.utcnow(), "locked_until": None})
+    await db.jobs.update_one({"id": job_id}, {"$set": fields})
+
+def _job_lease() -> datetime:
+    return datetime.utcnow() + timedelta(seconds=JOB_LEASE_SECONDS)
+
+async def _renew_job_lease(job_id: str):
+    # Runs alongside the job, queued or running, for as long as this worker holds it
+    while True:
+        await asyncio.sleep(JOB_LEASE_SECONDS / 3)
+        try:
+            await db.jobs.update_one(
+                {"id": job_id, "status": {"$in": ["queued", "running"]}},
+                {"$set": {"locked_until": _job_lease()}},
+            )
+        except Exception as e:
+            logger.warning(f"Could not renew lease for job {job_id}: {e}")
+
+async def expire_stale_jobs(query: Optional[Dict[str, Any]] = None) -> int:
+    # Jobs whose lease ran out belong to a worker that died
+    stale = {
+        **(query or {}),
+        "status": {"$in": ["queued", "running"]},
+        "locked_until": {"$lt": datetime.utcnow()},
+    }
+    result = await db.jobs.update_many(stale, {"$set": {
+        "status": "failed",
+        "error": "The worker running this job stopped before it finished",
+        "finished_at": datetime.utcnow(),
+        "locked_until": None,
+    }})
+    if result.modified_count:
+        logger.warning(f"Marked {result.modified_count} abandoned job(s) as failed")
+    return result.modified_count
+
+async def _run_job(job: Job, args: tuple):
+    if job.job_type not in _job_semaphores:
+        _job_semaphores[job.job_type] = asyncio.Semaphore(JOB_CONCURRENCY.get(job.job_type, 1))
+    heartbeat = asyncio.create_task(_renew_job_lease(job.id))
+    try:
+        async with _job_semaphores[job.job_type]:
+            started = await db.jobs.find_one_and_update(
+                {"id": job.id, "cancel_requested": False},
+                {"$set": {"status": "running", "started_at": datetime.utcnow()}},
+            )
+            if started is None:
+                await _finish_job(job.id, "cancelled")
+                return
+            result = await JOB_HANDLERS[job.job_type](
+                JobContext(job.id, Shop(job.shop_id, job.created_by, JOB_READ_CLASSES[job.job_type])), job.params, *args
+            )
+        await _finish_job(job.id, "completed", progress=1, result=result)
+    except (JobCancelled, asyncio.CancelledError):
+        await _finish_job(job.id, "cancelled")
+    except Exception as e:
+        logger.exception(f"Job {job.id} ({job.job_type}) failed")
+        await _finish_job(job.id, "failed", error=str(e))
+    finally:
+        heartbeat.cancel()
+
+async def submit_job(job_type: str, shop: Shop, params: Optional[Dict[str, Any]] = None, *args) -> Job:
+    job = Job(job_type=job_type, params=params or {}, shop_id=shop.id, created_by=shop.user, locked_until=_job_lease())
+    await db.jobs.insert_one(job.dict())
+    task = asyncio.create_task(_run_job(job, args))
+    running_jobs[job.id] = task
+    task.add_done_callback(lambda _: running_jobs.pop(job.id, None))
+    return job
+
+# Invoice PDF rendering
+# Bills are rendered as raw PDF page content streams using the standard
+# Helvetica fonts, so no font files are embedded and page streams from
+# different bills can be concatenated into one document cheaply.
+PDF_PAGE_WIDTH = 595
+PDF_PAGE_HEIGHT = 842
+PDF_MARGIN = 50
+PDF_ROWS_PER_PAGE = 28
+PDF_ROW_HEIGHT = 18
+PDF_TABLE_TOP = 655
+
+# Helvetica advance widths (1/1000 em) for ASCII 32-126, from the standard AFM
+_HELVETICA_WIDTHS = dict(zip(range(32, 127), [
+    278, 278, 355, 556, 556, 889, 667, 191, 333, 333, 389, 584, 278, 333, 278, 278,
+    556, 556, 556, 556, 556, 556, 556, 556, 556, 556, 278, 278, 584, 584, 584, 556,
+    1015, 667, 667, 722, 722, 667, 611, 778, 722, 278, 500, 667, 556, 833, 722, 778,
+    667, 778, 722, 667, 611, 722, 667, 944, 667, 667, 611, 278, 278, 278, 469, 556,
+    333, 556, 556, 500, 556, 556, 278, 556, 556, 222, 222, 500, 222, 833, 556, 556,
+    556, 556, 333, 500, 278, 556, 500, 722, 500, 500, 500, 334, 260, 334, 584,
+]))
+
+# (heading, x position, alignment) for the invoice line-item table
+INVOICE_COLUMNS = [
+    ("Item", PDF_MARGIN, "left"),
+    ("Qty", 360, "right"),
+    ("Rate", 450, "right"),
+    ("Amount", PDF_PAGE_WIDTH - PDF_MARGIN, "right"),
+]
+
+@lru_cache(maxsize=8192)
+def _text_width(text: str, size: float) -> float:
+    return sum(_HELVETICA_WIDTHS.get(ord(c), 556) for c in text) * size / 1000
+
+def _pdf_string(text: str) -> bytes:
+    escaped = text.replace("\\", "\\\\").replace("(", "\\(").replace(")", "\\)")
+    return escaped.encode("latin-1", errors="replace")
+
+def _text_op(x: float, y: float, text: str, size: float = 10, font: str = "F1") -> bytes:
+    return b"BT /%s %g Tf %.2f %.2f Td (%s) Tj ET\n" % (font.encode(), size, x, y, _pdf_string(text))
+
+def _aligned_text_op(x: float, y: float, text: str, align: str, size: float = 10, font: str = "F1") -> bytes:
+    if align == "right":
+        x -= _text_width(text, size)
+    return _text_op(x, y, text, size, font)
+
+def _line_op(x1: float, y1: float, x2: float, y2: float) -> bytes:
+    return b"%.2f %.2f m %.2f %.2f l S\n" % (x1, y1, x2, y2)
+
+def _fit_text(text: str, max_width: float, size: float = 10) -> str:
+    if _text_width(text, size) <= max_width:
+        return text
+    while text and _text_width(text + "...", size) > max_width:
+        text = text[:-1]
+    return text + "..."
+
+def _format_amount(amount: Optional[float]) -> str:
+    return f"{amount or 0:,.2f}"
+
+def _compile_invoice_template() -> Dict[str, bytes]:
+    # Static parts of every invoice page are built once per process
+    header_y = PDF_TABLE_TOP + PDF_ROW_HEIGHT
+    table_header = b"".join(
+        _aligned_text_op(x, header_y, heading, align, size=10, font="F2")
+        for heading, x, align in INVOICE_COLUMNS
+    )
+    rules = (
+        b"0.5 w\n"
+        + _line_op(PDF_MARGIN, header_y - 6, PDF_PAGE_WIDTH - PDF_MARGIN, header_y - 6)
+    )
+    return {
+        "table_header": table_header + rules,
+    }
+
+INVOICE_TEMPLATE = _compile_invoice_template()
+
+@lru_cache(maxsize=256)
+def _shop_header(shop_name: str) -> bytes:
+    return _text_op(PDF_MARGIN, 790, shop_name, size=18, font="F2")
+
+def render_bill_pages(bill: Dict[str, Any]) -> List[bytes]:
+    """Render one bill into compressed PDF page content streams."""
+    items = bill.get("items") or []
+    chunks = [items[i:i + PDF_ROWS_PER_PAGE] for i in range(0, len(items), PDF_ROWS_PER_PAGE)] or [[]]
+    right_edge = PDF_PAGE_WIDTH - PDF_MARGIN
+    item_width = INVOICE_COLUMNS[1][1] - PDF_MARGIN - 60
+    pages = []
+
+    for page_number, chunk in enumerate(chunks, start=1):
+        ops = [_shop_header(bill.get("shop_name") or SHOP_NAME)]
+        ops.append(_aligned_text_op(right_edge, 790, f"Invoice {bill['bill_number']}", "right", size=12, font="F2"))
+        ops.append(_aligned_text_op(right_edge, 772, utc_to_shop(bill["created_at"]).strftime("%d-%m-%Y %H:%M"), "right"))
+        if bill.get("customer_name") or bill.get("customer_phone"):
+            customer = " - ".join(v for v in (bill.get("customer_name"), bill.get("customer_phone")) if v)
+            ops.append(_text_op(PDF_MARGIN, 740, f"Customer: {customer}"))
+        ops.append(_text_op(PDF_MARGIN, 722, f"Pricing: {bill['pricing_mode'].title()}   Type: {bill['bill_type'].title()}"))
+        ops.append(INVOICE_TEMPLATE["table_header"])
+
+        y = PDF_TABLE_TOP
+        for item in chunk:
+            ops.append(_text_op(PDF_MARGIN, y, _fit_text(item["item_name"], item_width)))
+            ops.append(_aligned_text_op(INVOICE_COLUMNS[1][1], y, str(item["quantity"]), "right"))
+            ops.append(_aligned_text_op(INVOICE_COLUMNS[2][1], y, _format_amount(item["sale_price"]), "right"))
+            ops.append(_aligned_text_op(right_edge, y, _format_amount(item["subtotal"]), "right"))
+            y -= PDF_ROW_HEIGHT
+
+        if page_number == len(chunks):
+            totals_y = PDF_TABLE_TOP - PDF_ROWS_PER_PAGE * PDF_ROW_HEIGHT
+            ops.append(_line_op(INVOICE_COLUMNS[1][1] - 60, totals_y + 12, right_edge, totals_y + 12))
+            totals = [("Total", bill["total_amount"]), ("Paid", bill["amount_paid"])]
+            if bill["bill_type"] == "credit":
+                totals.append(("Balance due", bill.get("remaining_balance")))
+            for label, amount in totals:
+                ops.append(_text_op(INVOICE_COLUMNS[1][1] - 60, totals_y, label, font="F2"))
+                ops.append(_aligned_text_op(right_edge, totals_y, f"Rs. {_format_amount(amount)}", "right"))
+                totals_y -= PDF_ROW_HEIGHT
+
+        ops.append(_aligned_text_op(right_edge, 40, f"Page {page_number} of {len(chunks)}", "right", size=8))
+        pages.append(zlib.compress(b"".join(ops)))
+
+    return pages
+
+def render_bill_batch(bills: List[Dict[str, Any]]) -> List[List[bytes]]:
+    return [render_bill_pages(bill) for bill in bills]
+
+def assemble_pdf(pages: List[bytes]) -> bytes:
+    """Wrap compressed page content streams into a complete PDF document."""
+    objects = [
+        b"<< /Type /Catalog /Pages 2 0 R >>",
+        b"",  # page tree, filled in once the page objects are numbered
+        b"<< /Font << /F1 4 0 R /F2 5 0 R >> >>",
+        b"<< /Type /Font /Subtype /Type1 /BaseFont /Helvetica /Encoding /WinAnsiEncoding >>",
+        b"<< /Type /Font /Subtype /Type1 /BaseFont /Helvetica-Bold /Encoding /WinAnsiEncoding >>",
+    ]
+    kids = []
+    for content in pages:
+        objects.append(b"<< /Length %d /Filter /FlateDecode >>\nstream\n%s\nendstream" % (len(content), content))
+        objects.append(
+            b"<< /Type /Page /Parent 2 0 R /MediaBox [0 0 %d %d] /Resources 3 0 R /Contents %d 0 R >>"
+            % (PDF_PAGE_WIDTH, PDF_PAGE_HEIGHT, len(objects))
+        )
+        kids.append(b"%d 0 R" % len(objects))
+    objects[1] = b"<< /Type /Pages /Kids [%s] /Count %d >>" % (b" ".join(kids), len(kids))
+
+    output = bytearray(b"%PDF-1.4\n%\xe2\xe3\xcf\xd3\n")
+    offsets = []
+    for number, body in enumerate(objects, start=1):
+        offsets.append(len(output))
+        output += b"%d 0 obj\n%s\nendobj\n" % (number, body)
+    xref_offset = len(output)
+    output += b"xref\n0 %d\n0000000000 65535 f \n" % (len(objects) + 1)
+    for offset in offsets:
+        output += b"%010d 00000 n \n" % offset
+    output += b"trailer\n<< /Size %d /Root 1 0 R >>\nstartxref\n%d\n%%EOF\n" % (len(objects) + 1, xref_offset)
+    return bytes(output)
+
+_pdf_executor: Optional[ProcessPoolExecutor] = None
+invoice_page_cache: "OrderedDict[tuple, List[bytes]]" = OrderedDict()
+
+def _init_pdf_worker():
+    # Warm the glyph width cache so the first real render does not pay for it
+    for size in (8, 10, 12):
+        _text_width("0123456789,.Rs ", size)
+
+def get_pdf_executor() -> ProcessPoolExecutor:
+    global _pdf_executor
+    if _pdf_executor is None:
+        _pdf_executor = ProcessPoolExecutor(max_workers=PDF_WORKERS, initializer=_init_pdf_worker)
+    return _pdf_executor
+
+def invoice_cache_key(bill: Dict[str, Any]) -> tuple:
+    # The header prints the shop name, so renaming the shop must miss the cache
+    return (bill["id"], bill["updated_at"], bill.get("shop_name") or SHOP_NAME)
+
+async def render_invoice_pages(bills: List[Dict[str, Any]]) -> List[List[bytes]]:
+    """Return page streams for each bill, rendering cache misses across the PDF pool."""
+    keys = [invoice_cache_key(bill) for bill in bills]
+    # Hold on to the hits: a concurrent request may evict them while this one awaits
+    found = {key: invoice_page_cache[key] for key in keys if key in invoice_page_cache}
+    missing = [bill for bill, key in zip(bills, keys) if key not in found]
+
+    if missing:
+        # Split the misses into one chunk per worker to keep IPC overhead low
+        chunk_size = -(-len(missing) // PDF_WORKERS)
+        chunks = [missing[i:i + chunk_size] for i in range(0, len(missing), chunk_size)]
+        loop = asyncio.get_running_loop()
+        results = await asyncio.gather(*[
+            loop.run_in_executor(get_pdf_executor(), render_bill_batch, chunk) for chunk in chunks
+        ])
+        for chunk, rendered in zip(chunks, results):
+            for bill, pages in zip(chunk, rendered):
+                found[invoice_cache_key(bill)] = pages
+
+    for key, pages in found.items():
+        invoice_page_cache[key] = pages
+        invoice_page_cache.move_to_end(key)
+    while len(invoice_page_cache) > PDF_CACHE_SIZE:
+        invoice_page_cache.popitem(last=False)
+    return [found[key] for key in keys]
+
+# Job pool workers (run in separate processes)
+# pandas (and numpy/openpyxl through it) is imported inside the workers only,
+# so API processes never pay for it at boot
+def parse_item_rows(filename: str, content: bytes) -> List[Dict[str, Any]]:
+    import pandas as pd
+
+    if filename.endswith('.csv'):
+        df = pd.read_csv(io.StringIO(content.decode('utf-8')))
+    else:
+        df = pd.read_excel(io.BytesIO(content))
+
+    required_columns = ['name', 'cost_price', 'customer_price', 'carpenter_price']
+    if not all(col in df.columns for col in required_columns):
+        raise ValueError(f"Missing required columns: {required_columns}")
+
+    # An optional stock_quantity column restocks existing items by name
+    has_stock = 'stock_quantity' in df.columns
+    return [
+        {
+            'name': str(row['name']),
+            'cost_price': float(row['cost_price']),
+            'customer_price': float(row['customer_price']),
+            'carpenter_price': float(row['carpenter_price']),
+            'stock_quantity': int(row['stock_quantity']) if has_stock and pd.notna(row['stock_quantity']) else 0
+        }
+        for _, row in df.iterrows()
+    ]
+
+def render_items_csv(rows: List[Dict[str, Any]]) -> bytes:
+    import pandas as pd
+
+    df = pd.DataFrame(rows)
+    output = io.StringIO()
+    df.to_csv(output, index=False)
+    return output.getvalue().encode()
+
+async def fetch_export_rows(shop: Shop) -> List[Dict[str, Any]]:
+    items = await shop.db.items.find(shop.scope()).to_list(1000)
+    return [
+        {
+            'name': item['name'],
+            'cost_price': from_minor(item['cost_price']),
+            'customer_price': from_minor(item['customer_price']),
+            'carpenter_price': from_minor(item['carpenter_price']),
+            'stock_quantity': item.get('stock_quantity', 0),
+            'created_at': item['created_at'].strftime('%Y-%m-%d %H:%M:%S')
+        }
+        for item in items
+    ]
+
+@job_handler("import_items")
+async def run_import_items(ctx: JobContext, params: Dict[str, Any], content: bytes):
+    shop = ctx.shop
+    await ctx.report(0, "Parsing file")
+    rows = await run_in_job_pool(parse_item_rows, params["filename"], content)
+
+    items_created = 0
+    items_restocked = 0
+    for start in range(0, len(rows), JOB_BATCH_SIZE):
+        batch = rows[start:start + JOB_BATCH_SIZE]
+        now = datetime.utcnow()
+        # Resolve names to ids first so every upsert matches on the full shard key
+        names = list({row["name"] for row in batch})
+        found = await shop.db.items.find(shop.scope({"name": {"$in": names}}), {"id": 1, "name": 1}).to_list(None)
+        ids = {item["name"]: item["id"] for item in found}
+        operations = []
+        for row in batch:
+            item_id = ids.setdefault(row["name"], str(uuid.uuid4()))
+            prices = item_to_db({k: row[k] for k in ITEM_MONEY_FIELDS})
+            operations.append(UpdateOne(
+                shop.scope({"id": item_id}),
+                {
+                    "$set": {**prices, "updated_at": now},
+                    "$inc": {"stock_quantity": row["stock_quantity"]},
+                    "$setOnInsert": {"name": row["name"], "created_at": now},
+                },
+                upsert=True,
+            ))
+        result = await shop.db.items.bulk_write(operations, ordered=True)
+        await invalidate_item_cache(shop)
+        items_created += result.upserted_count
+        items_restocked += result.matched_count
+
+        movements = [
+            shop.scope(StockMovement(item_id=ids[row["name"]], change=row["stock_quantity"], reason="import", created_at=now).dict())
+            for row in batch if row["stock_quantity"]
+        ]
+        if movements:
+            await shop.db.stock_movements.insert_many(movements)
+
+        done = start + len(batch)
+        await ctx.report(done / len(rows), f"Imported {done} of {len(rows)} rows")
+
+    return {
+        "items_created": items_created,
+        "items_updated": items_restocked,
+        "message": f"Successfully imported {items_created} new items and updated {items_restocked} existing items"
+    }
+
+@job_handler("export_items", read_class="reporting")
+async def run_export_items(ctx: JobContext, params: Dict[str, Any]):
+    audit_find("export_items", ctx.shop.db.items, ctx.shop.scope(), limit=1000)
+    rows = await fetch_export_rows(ctx.shop)
+    await ctx.report(0.5, f"Rendering {len(rows)} items")
+    data = await run_in_job_pool(render_items_csv, rows)
+    await ctx.save_output("items_export.csv", "text/csv", data)
+    return {"items_exported": len(rows)}
+
+# Collections holding money fields, with the money fields of embedded bill items
+MONEY_COLLECTIONS = {
+    "items": (ITEM_MONEY_FIELDS, ()),
+    "bills": (BILL_MONEY_FIELDS, BILL_ITEM_MONEY_FIELDS),
+    "payments": (PAYMENT_MONEY_FIELDS, ()),
+}
+
+def legacy_money_filter(fields: tuple, item_fields: tuple) -> Dict[str, Any]:
+    clauses = [{field: {"$type": "double"}} for field in fields]
+    clauses += [{f"items.{field}": {"$type": "double"}} for field in item_fields]
+    return {"$or": clauses}
+
+async def has_legacy_money() -> bool:
+    for database in await tenant_databases():
+        for name, (fields, item_fields) in MONEY_COLLECTIONS.items():
+            if await database[name].find_one(legacy_money_filter(fields, item_fields), {"_id": 1}):
+                return True
+    return False
+
+@job_handler("migrate_money")
+async def run_migrate_money(ctx: JobContext, params: Dict[str, Any]):
+    # The migration is a maintenance pass over every shop's data, not just the submitter's
+    databases = await tenant_databases()
+    total = 0
+    for database in databases:
+        for name, (fields, item_fields) in MONEY_COLLECTIONS.items():
+            total += await database[name].count_documents(legacy_money_filter(fields, item_fields))
+    migrated = {name: 0 for name in MONEY_COLLECTIONS}
+
+    for database in databases:
+        for name, (fields, item_fields) in MONEY_COLLECTIONS.items():
+            collection = database[name]
+            legacy_filter = legacy_money_filter(fields, item_fields)
+            while True:
+                docs = await collection.find(legacy_filter).to_list(JOB_BATCH_SIZE)
+                if not docs:
+                    break
+                operations = []
+                for doc in docs:
+                    watched = [field for field in fields if field in doc] + (["items"] if item_fields else [])
+                    update = _convert_money({f: doc[f] for f in watched if f != "items"}, fields, stored_minor)
+                    if item_fields:
+                        update["items"] = [_convert_money(item, item_fields, stored_minor) for item in doc.get("items", [])]
+                    # Match on the values we read so a concurrent write is never overwritten;
+                    # a document skipped this way is picked up again by the next batch
+                    match = {"_id": doc["_id"], **{f: doc.get(f) for f in watched}}
+                    operations.append(UpdateOne(match, {"$set": update}))
+                result = await collection.bulk_write(operations, ordered=False)
+                migrated[name] += result.modified_count
+                done = sum(migrated.values())
+                await ctx.report(min(done / total, 1) if total else 1, f"Migrated {done} of {total} documents")
+
+    return {"migrated": migrated}
+
+async def start_money_migration(shop: Shop) -> Optional[Job]:
+    await expire_stale_jobs({"job_type": "migrate_money"})
+    active = await db.jobs.find_one(
+        {"job_type": "migrate_money", "status": {"$in": ["queued", "running"]}},
+        {"output_data": 0},
+    )
+    if active:
+        return Job(**active)
+    if not await has_legacy_money():
+        return None
+    return await submit_job("migrate_money", shop)
+
+# Credit customer aggregation shared by the credits page and the live feed
+CREDIT_CUSTOMER_GROUP = {
+    "_id": "$customer_phone",
+    "customer_name": {"$first": "$customer_name"},
+    "total_amount": {"$sum": minor_expr("total_amount")},
+    "paid_amount": {"$sum": minor_expr("amount_paid")},
+    "remaining_balance": {"$sum": minor_expr("remaining_balance")},
+    "last_payment_date": {"$max": "$updated_at"},
+    "bill_count": {"$sum": 1},
+    "bills": {"$push": "$id"}
+}
+
+def credit_customer_from_group(customer: Dict[str, Any]) -> CreditCustomer:
+    return CreditCustomer(
+        customer_phone=customer["_id"],
+        customer_name=customer["customer_name"] or "Unknown",
+        total_amount=from_minor(customer["total_amount"]),
+        paid_amount=from_minor(customer["paid_amount"]),
+        remaining_balance=from_minor(customer["remaining_balance"]),
+        last_payment_date=customer["last_payment_date"],
+        bill_count=customer["bill_count"],
+        bills=customer["bills"]
+    )
+
+# Credit statements
+# A statement merges a customer's credit bills and payments into one ledger
+# ordered by (date, entry kind, id). Bills sort before payments made at the
+# same instant. Keyset cursors carry the running balance, so a page never
+# needs to re-read earlier entries.
+STATEMENT_KINDS = {"bill": 0, "payment": 1}
+
+def encode_statement_cursor(entry_date: datetime, kind: str, entry_id: str, balance: int) -> str:
+    payload = json.dumps({"d": entry_date.isoformat(), "k": kind, "i": entry_id, "b": balance})
+    return base64.urlsafe_b64encode(payload.encode()).decode()
+
+def decode_statement_cursor(cursor: str) -> Dict[str, Any]:
+    try:
+        payload = json.loads(base64.urlsafe_b64decode(cursor.encode()))
+        if payload["k"] not in STATEMENT_KINDS:
+            raise ValueError(f"Unknown statement entry kind: {payload['k']}")
+        return {
+            "date": datetime.fromisoformat(payload["d"]),
+            "kind": payload["k"],
+            "id": payload["i"],
+            "balance": int(payload["b"]),
+        }
+    except (ValueError, KeyError, TypeError):
+        raise HTTPException(status_code=400, detail="Invalid statement cursor")
+
+def _after_cursor(date_field: str, kind: str, cursor: Optional[Dict[str, Any]]) -> Dict[str, Any]:
+    if cursor is None:
+        return {}
+    clauses = [{date_field: {"$gt": cursor["date"]}}]
+    if STATEMENT_KINDS[kind] > STATEMENT_KINDS[cursor["kind"]]:
+        clauses.append({date_field: cursor["date"]})
+    elif kind == cursor["kind"]:
+        clauses.append({date_field: cursor["date"], "id": {"$gt": cursor["id"]}})
+    return {"$or": clauses}
+
+def _date_window(date_field: str, start_date: Optional[datetime], end_date: Optional[datetime]) -> Dict[str, Any]:
+    window = {}
+    if start_date:
+        window["$gte"] = start_date
+    if end_date:
+        window["$lt"] = end_date
+    return {date_field: window} if window else {}
+
+async def statement_payment_totals(shop: Shop, customer_phone: str) -> Dict[str, int]:
+    # Payments recorded against each bill, used to split a bill's amount_paid
+    # into the part paid at checkout and the later payments listed separately
+    pipeline = [
+        {"$match": shop.scope({"customer_phone": customer_phone})},
+        {"$group": {"_id": "$bill_id", "amount": {"$sum": minor_expr("amount")}}},
+    ]
+    audit_aggregate("get_credit_statement", shop.db.payments, pipeline)
+    result = await shop.db.payments.aggregate(pipeline).to_list(None)
+    return {row["_id"]: stored_minor(row["amount"]) for row in result}
+
+async def statement_opening_balance(shop: Shop, customer_phone: str, start_date: datetime, payment_totals: Dict[str, int]) -> int:
+    bills_pipeline = [
+        {"$match": shop.scope({"customer_phone": customer_phone, "bill_type": "credit", "created_at": {"$lt": start_date}})},
+        {"$group": {"_id": None, "remaining": {"$sum": minor_expr("remaining_balance")}, "bills": {"$push": "$id"}}},
+    ]
+    payments_pipeline = [
+        {"$match": shop.scope({"customer_phone": customer_phone, "payment_date": {"$lt": start_date}})},
+        {"$group": {"_id": None, "amount": {"$sum": minor_expr("amount")}}},
+    ]
+    payments = await shop.db.payments.aggregate(payments_pipeline).to_list(1)
+    balance = 0
+    for collection in await bill_collections(shop, end=start_date):
+        bills = await collection.aggregate(bills_pipeline).to_list(1)
+        if bills:
+            # Balance before the window ignores payments made later against those bills
+            balance += stored_minor(bills[0]["remaining"]) or 0
+            balance += sum(payment_totals.get(bill_id, 0) for bill_id in bills[0]["bills"])
+    if payments:
+        balance -= stored_minor(payments[0]["amount"])
+    return balance
+
+async def statement_start_balance(
+    shop: Shop,
+    customer_phone: str,
+    start_date: Optional[datetime],
+    cursor: Optional[Dict[str, Any]],
+    payment_totals: Dict[str, int],
+) -> int:
+    if cursor is not None:
+        return cursor["balance"]
+    if start_date is not None:
+        return await statement_opening_balance(shop, customer_phone, start_date, payment_totals)
+    return 0
+
+async def statement_entries(
+    shop: Shop,
+    customer_phone: str,
+    balance: int,
+    payment_totals: Dict[str, int],
+    start_date: Optional[datetime] = None,
+    end_date: Optional[datetime] = None,
+    cursor: Optional[Dict[str, Any]] = None,
+):
+    """Yield ledger entries in order, each with the running balance after it (minor units)."""
+    bill_filter = shop.scope({
+        "customer_phone": customer_phone,
+        "bill_type": "credit",
+        **_date_window("created_at", start_date, end_date),
+    })
+    payment_filter = shop.scope({
+        "customer_phone": customer_phone,
+        **_date_window("payment_date", start_date, end_date),
+    })
+    if cursor is not None:
+        bill_filter = {"$and": [bill_filter, _after_cursor("created_at", "bill", cursor)]}
+        payment_filter = {"$and": [payment_filter, _after_cursor("payment_date", "payment", cursor)]}
+
+    bill_sort = [("created_at", 1), ("id", 1)]
+    payment_sort = [("payment_date", 1), ("id", 1)]
+    audit_find("get_credit_statement", shop.db.bills, bill_filter, sort=dict(bill_sort))
+    audit_find("get_credit_statement", shop.db.payments, payment_filter, sort=dict(payment_sort))
+    bills = merge_sorted([
+        collection.find(
+            bill_filter,
+            {"_id": 0, "id": 1, "bill_number": 1, "created_at": 1, "total_amount": 1, "amount_paid": 1},
+        ).sort(bill_sort)
+        for collection in await bill_collections(shop, start_date, end_date)
+    ], key=lambda bill: (bill["created_at"], bill["id"]))
+    payments = shop.db.payments.find(
+        payment_filter,
+        {"_id": 0, "id": 1, "bill_id": 1, "payment_date": 1, "amount": 1, "notes": 1},
+    ).sort(payment_sort)
+
+    bill = await _next_or_none(bills)
+    payment = await _next_or_none(payments)
+    while bill is not None or payment is not None:
+        if payment is None or (
+            bill is not None
+            and (bill["created_at"], 0, bill["id"]) <= (payment["payment_date"], 1, payment["id"])
+        ):
+            debit = stored_minor(bill["total_amount"])
+            credit = stored_minor(bill["amount_paid"]) - payment_totals.get(bill["id"], 0)
+            balance += debit - credit
+            yield {
+                "date": bill["created_at"],
+                "entry_type": "bill",
+                "id": bill["id"],
+                "bill_id": bill["id"],
+                "reference": bill["bill_number"],
+                "debit": debit,
+                "credit": credit,
+                "balance": balance,
+            }
+            bill = await _next_or_none(bills)
+        else:
+            credit = stored_minor(payment["amount"])
+            balance -= credit
+            yield {
+                "date": payment["payment_date"],
+                "entry_type": "payment",
+                "id": payment["id"],
+                "bill_id": payment["bill_id"],
+                "reference": payment.get("notes") or "",
+                "debit": 0,
+                "credit": credit,
+                "balance": balance,
+            }
+            payment = await _next_or_none(payments)
+
+def present_statement_entry(entry: Dict[str, Any]) -> StatementEntry:
+    return StatementEntry(**_convert_money(entry, STATEMENT_MONEY_FIELDS, from_minor))
+
+# Credit aging
+def parse_aging_edges(edges: Optional[str]) -> List[int]:
+    if not edges:
+        return AGING_DEFAULT_EDGES
+    try:
+        parsed = [int(edge) for edge in edges.split(",")]
+    except ValueError:
+        raise HTTPException(status_code=400, detail="Edges must be comma separated day counts")
+    if parsed[0] < 0 or any(b <= a for a, b in zip(parsed, parsed[1:])):
+        raise HTTPException(status_code=400, detail="Edges must be increasing and non-negative")
+    return parsed
+
+def aging_bucket_labels(edges: List[int]) -> List[str]:
+    # [30, 60, 90] -> ["0-30", "31-60", "61-90", "90+"]
+    lower_bounds = [0] + [edge + 1 for edge in edges[:-1]]
+    labels = [f"{low}-{high}" for low, high in zip(lower_bounds, edges)]
+    return labels + [f"{edges[-1]}+"]
+
+def aging_pipeline(shop: Shop, now: datetime, edges: List[int], labels: List[str], skip: int, limit: int) -> List[Dict[str, Any]]:
+    boundaries = [0] + [edge + 1 for edge in edges]
+    bucket_switch = {
+        "$switch": {
+            "branches": [
+                {"case": {"$lte": ["$age_days", edge]}, "then": label}
+                for edge, label in zip(edges, labels)
+            ],
+            "default": labels[-1],
+        }
+    }
+    return [
+        {"$match": shop.scope({"bill_type": "credit", "remaining_balance": {"$gt": 0}})},
+        {
+            "$project": {
+                "customer_phone": 1,
+                "customer_name": 1,
+                "remaining_balance": minor_expr("remaining_balance"),
+                "age_days": {
+                    "$max": [0, {"$floor": {"$divide": [{"$subtract": [now, "$created_at"]}, 86400000]}}]
+                },
+            }
+        },
+        {
+            "$facet": {
+                "totals": [
+                    {
+                        "$bucket": {
+                            "groupBy": "$age_days",
+                            "boundaries": boundaries,
+                            "default": labels[-1],
+                            "output": {"amount": {"$sum": minor_expr("remaining_balance")}, "bill_count": {"$sum": 1}},
+                        }
+                    }
+                ],
+                "customers": [
+                    {
+                        "$group": {
+                            "_id": {"phone": "$customer_phone", "bucket": bucket_switch},
+                            "customer_name": {"$first": "$customer_name"},
+                            "amount": {"$sum": minor_expr("remaining_balance")},
+                            "bill_count": {"$sum": 1},
+                            "oldest_days": {"$max": "$age_days"},
+                        }
+                    },
+                    {
+                        "$group": {
+                            "_id": "$_id.phone",
+                            "customer_name": {"$first": "$customer_name"},
+                            "total": {"$sum": "$amount"},
+                            "bill_count": {"$sum": "$bill_count"},
+                            "oldest_days": {"$max": "$oldest_days"},
+                            "buckets": {"$push": {"k": "$_id.bucket", "v": "$amount"}},
+                        }
+                    },
+                    {"$sort": {"total": -1, "_id": 1}},
+                    {"$skip": skip},
+                    {"$limit": limit},
+                ],
+                "customer_count": [
+                    {"$group": {"_id": "$customer_phone"}},
+                    {"$count": "count"},
+                ],
+            }
+        },
+    ]
+
+def aging_report_from_result(result: Dict[str, Any], now: datetime, edges: List[int], labels: List[str], skip: int, limit: int) -> AgingReport:
+    # $bucket names boundary buckets by their lower bound
+    bucket_names = dict(zip([0] + [edge + 1 for edge in edges[:-1]], labels))
+    totals = {label: 0 for label in labels}
+    bill_counts = {label: 0 for label in labels}
+    for bucket in result["totals"]:
+        label = bucket_names.get(bucket["_id"], bucket["_id"])
+        totals[label] = bucket["amount"]
+        bill_counts[label] = bucket["bill_count"]
+
+    customers = []
+    for customer in result["customers"]:
+        buckets = {label: 0.0 for label in labels}
+        buckets.update({entry["k"]: from_minor(entry["v"]) for entry in customer["buckets"]})
+        customers.append(AgingCustomer(
+            customer_phone=customer["_id"],
+            customer_name=customer["customer_name"] or "Unknown",
+            total=from_minor(customer["total"]),
+            bill_count=customer["bill_count"],
+            oldest_days=customer["oldest_days"],
+            buckets=buckets
+        ))
+
+    return AgingReport(
+        as_of=now,
+        edges=edges,
+        bucket_labels=labels,
+        totals={label: from_minor(amount) for label, amount in totals.items()},
+        bill_counts=bill_counts,
+        total_outstanding=from_minor(sum(totals.values())),
+        customers=customers,
+        customer_count=result["customer_count"][0]["count"] if result["customer_count"] else 0,
+        skip=skip,
+        limit=limit
+    )
+
+# Live dashboard feed
+# One feed per shop per worker watches that shop's bills and payments (change
+# streams, or polling on a standalone mongod) and fans the resulting events
+# out to every connected screen, so the shared totals are computed once per change.
+TOTALS_MONEY_FIELDS = (
+    "total_sales", "total_profit", "outstanding_amount", "paid_bills_amount", "credit_bills_amount",
+)
+CHANGE_STREAM_UNSUPPORTED_CODES = {40573, 40324}
+
+async def compute_today_totals(shop: Shop) -> Dict[str, Any]:
+    start, end = get_date_range("today")
+    pipeline = [
+        {"$match": shop.scope({"created_at": {"$gte": start, "$lt": end}})},
+        {
+            "$group": {
+                "_id": None,
+                "total_sales": {"$sum": minor_expr("total_amount")},
+                "total_profit": {"$sum": minor_expr("profit")},
+                "bills_count": {"$sum": 1},
+                "paid_bills_count": {"$sum": {"$cond": [{"$eq": ["$bill_type", "paid"]}, 1, 0]}},
+                "credit_bills_count": {"$sum": {"$cond": [{"$eq": ["$bill_type", "credit"]}, 1, 0]}},
+                "paid_bills_amount": {"$sum": {"$cond": [{"$eq": ["$bill_type", "paid"]}, minor_expr("total_amount"), 0]}},
+                "credit_bills_amount": {"$sum": {"$cond": [{"$eq": ["$bill_type", "credit"]}, minor_expr("total_amount"), 0]}},
+            }
+        },
+    ]
+    outstanding_pipeline = [
+        {"$match": shop.scope({"bill_type": "credit", "remaining_balance": {"$gt": 0}})},
+        {"$group": {"_id": None, "outstanding_amount": {"$sum": minor_expr("remaining_balance")}}},
+    ]
+    audit_aggregate("live_feed", shop.db.bills, pipeline)
+    audit_aggregate("live_feed", shop.db.bills, outstanding_pipeline)
+    result = await shop.db.bills.aggregate(pipeline).to_list(1)
+    outstanding = await shop.db.bills.aggregate(outstanding_pipeline).to_list(1)
+
+    totals = {field: 0 for field in TOTALS_MONEY_FIELDS}
+    totals.update({"bills_count": 0, "paid_bills_count": 0, "credit_bills_count": 0})
+    if result:
+        totals.update({k: v for k, v in result[0].items() if k != "_id"})
+    if outstanding:
+        totals["outstanding_amount"] = outstanding[0]["outstanding_amount"]
+    totals["start_date"] = start
+    totals["end_date"] = end
+    return totals
+
+def present_totals(totals: Dict[str, Any]) -> Dict[str, Any]:
+    presented = _convert_money(totals, TOTALS_MONEY_FIELDS, from_minor)
+    presented["start_date"] = totals["start_date"].isoformat()
+    presented["end_date"] = totals["end_date"].isoformat()
+    bills_count = totals["bills_count"]
+    presented["average_bill_amount"] = presented["total_sales"] / bills_count if bills_count else 0
+    presented["profit_margin"] = (
+        totals["total_profit"] / totals["total_sales"] * 100 if totals["total_sales"] > 0 else 0
+    )
+    return presented
+
+async def compute_customer_balance(shop: Shop, customer_phone: str) -> Dict[str, Any]:
+    pipeline = [
+        {"$match": shop.scope({"customer_phone": customer_phone, "bill_type": "credit"})},
+        {"$group": CREDIT_CUSTOMER_GROUP},
+    ]
+    audit_aggregate("live_feed", shop.db.bills, pipeline)
+    result = await merge_archived_credit(shop, [customer_phone], await shop.db.bills.aggregate(pipeline).to_list(1), "live_feed")
+    if not result:
+        return {"customer_phone": customer_phone, "remaining_balance": 0, "bill_count": 0}
+    return credit_customer_from_group(result[0]).dict()
+
+class LiveFeed:
+    def __init__(self, shop: Shop):
+        self.shop = shop
+        self.subscribers = set()
+        self.totals: Optional[Dict[str, Any]] = None
+        self._task: Optional[asyncio.Task] = None
+        self._resume_token = None
+        self._last_resync = 0.0
+        self._stale = False
+
+    async def subscribe(self) -> asyncio.Queue:
+        await self.ensure_started()
+        queue = asyncio.Queue(maxsize=LIVE_QUEUE_SIZE)
+        self.subscribers.add(queue)
+        return queue
+
+    def unsubscribe(self, queue: asyncio.Queue):
+        self.subscribers.discard(queue)
+        if not self.subscribers and self._task is not None:
+            # Nobody is listening: close the change stream. Totals are not kept
+            # up to date from here on, so the next subscriber recomputes them
+            self._task.cancel()
+            self._task = None
+            self.totals = None
+            self._resume_token = None
+            self._stale = False
+
+    async def ensure_started(self):
+        if self.totals is None:
+            await self.refresh_totals(broadcast=False)
+        if self._task is None or self._task.done():
+            self._task = asyncio.create_task(self._run())
+
+    async def stop(self):
+        if self._task is not None:
+            self._task.cancel()
+            await asyncio.gather(self._task, return_exceptions=True)
+
+    def snapshot(self) -> Dict[str, Any]:
+        return {"totals": present_totals(self.totals)}
+
+    def publish(self, event: str, data: Dict[str, Any]):
+        message = f"event: {event}\ndata: {json.dumps(data, default=str)}\n\n"
+        for queue in list(self.subscribers):
+            try:
+                queue.put_nowait(message)
+            except asyncio.QueueFull:
+                # Drop clients that stop reading; EventSource reconnects and gets a fresh snapshot
+                self.subscribers.discard(queue)
+                while not queue.empty():
+                    queue.get_nowait()
+                queue.put_nowait(None)
+
+    def _publish_totals(self, previous: Optional[Dict[str, Any]]):
+        current = present_totals(self.totals)
+        delta = {}
+        if previous is not None:
+            before = present_totals(previous)
+            delta = {
+                k: current[k] - before[k]
+                for k, v in current.items()
+                if isinstance(v, (int, float)) and current[k] != before[k]
+            }
+        self.publish("totals", {"totals": current, "delta": delta})
+
+    async def refresh_totals(self, broadcast: bool = True):
+        previous = self.totals
+        self._stale = False
+        self.totals = await compute_today_totals(self.shop)
+        self._last_resync = time.monotonic()
+        if broadcast:
+            self._publish_totals(previous)
+
+    def apply_bill_insert(self, bill: Dict[str, Any]):
+        # New bills only ever add to today's totals, so apply them without a query
+        previous = dict(self.totals)
+        total_amount = stored_minor(bill.get("total_amount")) or 0
+        if self.totals["start_date"] <= bill["created_at"] < self.totals["end_date"]:
+            kind = "paid" if bill.get("bill_type") == "paid" else "credit"
+            self.totals["total_sales"] += total_amount
+            self.totals["total_profit"] += stored_minor(bill.get("profit")) or 0
+            self.totals["bills_count"] += 1
+            self.totals[f"{kind}_bills_count"] += 1
+            self.totals[f"{kind}_bills_amount"] += total_amount
+        if bill.get("bill_type") == "credit":
+            self.totals["outstanding_amount"] += max(stored_minor(bill.get("remaining_balance")) or 0, 0)
+        self._publish_totals(previous)
+
+    async def publish_customer(self, customer_phone: str):
+        self.publish("customer", await compute_customer_balance(self.shop, customer_phone))
+
+    async def _maybe_resync(self):
+        # Periodic full recompute rolls the window over at midnight and picks up
+        # changes the polling fallback cannot see, such as deletes
+        since = time.monotonic() - self._last_resync
+        if since >= LIVE_RESYNC_INTERVAL or (self._stale and since >= LIVE_REFRESH_INTERVAL):
+            await self.refresh_totals()
+
+    def _affects_totals(self, bill: Dict[str, Any]) -> bool:
+        # Only today's bills and open credit feed the totals; archiving old
+        # closed bills deletes many documents that change nothing here
+        created_today = self.totals is not None and self.totals["start_date"] <= bill["created_at"] < self.totals["end_date"]
+        return created_today or (bill.get("bill_type") == "credit" and (stored_minor(bill.get("remaining_balance")) or 0) > 0)
+
+    async def _handle_bill(self, operation: str, bill: Optional[Dict[str, Any]], before: Optional[Dict[str, Any]] = None):
+        if operation == "insert" and bill:
+            self.apply_bill_insert(bill)
+        elif operation == "delete":
+            # Without a pre-image the delete is left to the periodic resync
+            if before is not None and self._affects_totals(before):
+                self._stale = True
+            bill = before
+        else:
+            self._stale = True
+        if bill and bill.get("bill_type") == "credit" and bill.get("customer_phone"):
+            await self.publish_customer(bill["customer_phone"])
+
+    def _handle_payment(self, payment: Dict[str, Any]):
+        self.publish("payment", Payment(**payment_from_db(payment)).dict())
+
+    async def _run(self):
+        while True:
+            try:
+                await self._watch()
+            except asyncio.CancelledError:
+                raise
+            except OperationFailure as e:
+                if e.code in CHANGE_STREAM_UNSUPPORTED_CODES:
+                    logger.info("Change streams unavailable, live feed falling back to polling")
+                    await self._poll()
+                    continue
+                logger.exception("Live feed change stream failed, restarting")
+                await self._restart()
+            except Exception:
+                logger.exception("Live feed failed, restarting")
+                await self._restart()
+
+    async def _restart(self):
+        # Events may have been missed, so start over from a full recompute
+        self._resume_token = None
+        await asyncio.sleep(LIVE_POLL_INTERVAL)
+        try:
+            await self.refresh_totals()
+        except Exception:
+            logger.exception("Live feed could not recompute totals")
+
+    async def _watch(self):
+        # Deletes are matched on the bill's pre-image (enabled on bills by
+        # ensure_indexes), so a shop's feed never sees other shops' deletes
+        pipeline = [{"$match": {
+            "ns.coll": {"$in": ["bills", "payments"]},
+            "$or": [{"fullDocument.shop_id": self.shop.id}, {"fullDocumentBeforeChange.shop_id": self.shop.id}],
+        }}]
+        async with self.shop.db.watch(
+            pipeline,
+            full_document="updateLookup",
+            full_document_before_change="whenAvailable",
+            resume_after=self._resume_token,
+            max_await_time_ms=1000,
+        ) as stream:
+            while stream.alive:
+                change = await stream.try_next()
+                if change is not None:
+                    self._resume_token = stream.resume_token
+                    if change["ns"]["coll"] == "bills":
+                        await self._handle_bill(change["operationType"], change.get("fullDocument"), change.get("fullDocumentBeforeChange"))
+                    elif change["operationType"] == "insert":
+                        self._handle_payment(change["fullDocument"])
+                await self._maybe_resync()
+
+    async def _poll(self):
+        bill_cursor = payment_cursor = datetime.utcnow()
+        while True:
+            await asyncio.sleep(LIVE_POLL_INTERVAL)
+            bills = await self.shop.db.bills.find(
+                self.shop.scope({"updated_at": {"$gt": bill_cursor}})
+            ).sort("updated_at", 1).to_list(1000)
+            payments = await self.shop.db.payments.find(
+                self.shop.scope({"payment_date": {"$gt": payment_cursor}})
+            ).sort("payment_date", 1).to_list(1000)
+            if bills:
+                bill_cursor = bills[-1]["updated_at"]
+                await self.refresh_totals()
+                phones = {b["customer_phone"] for b in bills if b.get("bill_type") == "credit" and b.get("customer_phone")}
+                for phone in phones:
+                    await self.publish_customer(phone)
+            for payment in payments:
+                payment_cursor = payment["payment_date"]
+                self._handle_payment(payment)
+            await self._maybe_resync()
+
+live_feeds: Dict[str, LiveFeed] = {}
+
+def get_live_feed(shop: Shop) -> LiveFeed:
+    if shop.id not in live_feeds:
+        live_feeds[shop.id] = LiveFeed(Shop(shop.id))
+    return live_feeds[shop.id]
+
+# Bill archive
+# Closed bills (paid, or credit with nothing left to pay) older than the
+# cutoff are moved into one collection per created_at year. The archive
+# layout is stored per shop in archive_state. Reads consult archives only
+# when the requested range starts before the shop's archive cutoff.
+ARCHIVE_STATE_ID = "bills"
+ARCHIVE_COLLECTION_PREFIX = "bills_archive_"
+_archive_state_cache: Dict[str, Dict[str, Any]] = {}
+
+def archive_state_id(shop: Shop) -> str:
+    return f"{ARCHIVE_STATE_ID}:{shop.id}"
+
+def archive_collection(shop: Shop, year: int):
+    return shop.db[f"{ARCHIVE_COLLECTION_PREFIX}{year}"]
+
+def closed_bill_filter(cutoff: datetime) -> Dict[str, Any]:
+    return {
+        "created_at": {"$lt": cutoff},
+        "$or": [
+            {"bill_type": "paid"},
+            {"bill_type": "credit", "remaining_balance": {"$lte": 0}},
+        ],
+    }
+
+async def get_archive_state(shop: Shop, refresh: bool = False) -> Dict[str, Any]:
+    cached = _archive_state_cache.get(shop.id)
+    if not refresh and cached is not None and time.monotonic() - cached["loaded_at"] < ARCHIVE_STATE_TTL:
+        return cached["state"]
+    # Always read the layout from the primary: a lagging secondary could still
+    # show bills as live after the archive job has removed them, and this
+    # cache is shared by the shop's primary and reporting reads
+    database = shop_database(shop.id)
+    state = await database.archive_state.find_one({"_id": archive_state_id(shop)}) or {"archived_before": None, "years": []}
+    _archive_state_cache[shop.id] = {"state": state, "loaded_at": time.monotonic()}
+    return state
+
+async def bill_collections(shop: Shop, start: Optional[datetime] = None, end: Optional[datetime] = None) -> List[Any]:
+    """The shop's live bills collection plus any archive years that overlap [start, end)."""
+    state = await get_archive_state(shop)
+    collections = [shop.db.bills]
+    if not state["years"] or (start is not None and start >= state["archived_before"]):
+        return collections
+    for year in sorted(state["years"], reverse=True):
+        if start is not None and year < start.year:
+            continue
+        if end is not None and datetime(year, 1, 1) >= end:
+            continue
+        collections.append(archive_collection(shop, year))
+    return collections
+
+async def merge_archived_credit(shop: Shop, phones: List[str], customers: List[Dict[str, Any]], route: str) -> List[Dict[str, Any]]:
+    """Add the archived credit bills of the given customers to their CREDIT_CUSTOMER_GROUP rows.
+
+    Only closed bills are archived, so balances are unchanged, but totals, paid
+    amounts, bill counts and bill lists cover the customer's whole history.
+    """
+    archives = (await bill_collections(shop))[1:]
+    if not archives or not phones:
+        return customers
+    by_phone = {customer["_id"]: customer for customer in customers}
+    pipeline = [
+        {"$match": shop.scope({"bill_type": "credit", "customer_phone": {"$in": phones}})},
+        {"$group": CREDIT_CUSTOMER_GROUP},
+    ]
+    for collection in archives:
+        audit_aggregate(route, collection, pipeline)
+        for archived in await collection.aggregate(pipeline).to_list(None):
+            customer = by_phone.get(archived["_id"])
+            if customer is None:
+                by_phone[archived["_id"]] = archived
+                continue
+            for field in ("total_amount", "paid_amount", "remaining_balance", "bill_count"):
+                customer[field] += archived[field]
+            customer["bills"] += archived["bills"]
+            customer["customer_name"] = customer["customer_name"] or archived["customer_name"]
+            dates = [d for d in (customer["last_payment_date"], archived["last_payment_date"]) if d is not None]
+            customer["last_payment_date"] = max(dates) if dates else None
+    return list(by_phone.values())
+
+async def find_bill(shop: Shop, bill_id: str, route: str) -> Optional[Dict[str, Any]]:
+    bill_filter = shop.scope({"id": bill_id})
+    audit_find(route, shop.db.bills, bill_filter, limit=1)
+    bill = await shop.db.bills.find_one(bill_filter)
+    if bill:
+        return bill
+    for collection in (await bill_collections(shop))[1:]:
+        bill = await collection.find_one(bill_filter)
+        if bill:
+            return bill
+    return None
+
+async def raise_missing_bill(shop: Shop, bill_id: str):
+    if await find_bill(shop, bill_id, "find_archived_bill"):
+        raise HTTPException(status_code=409, detail="Archived bills are read-only")
+    raise HTTPException(status_code=404, detail="Bill not found")
+
+async def merge_sorted(cursors: List[Any], key: Callable):
+    """Merge already-sorted async cursors into one ordered stream."""
+    heads = []
+    for index, cursor in enumerate(cursors):
+        head = await _next_or_none(cursor)
+        if head is not None:
+            heads.append((key(head), index, head))
+    heapq.heapify(heads)
+    while heads:
+        _, index, doc = heapq.heappop(heads)
+        yield doc
+        head = await _next_or_none(cursors[index])
+        if head is not None:
+            heapq.heappush(heads, (key(head), index, head))
+
+async def _next_or_none(cursor):
+    try:
+        return await cursor.__anext__()
+    except StopAsyncIteration:
+        return None
+
+async def ensure_archive_indexes(collection):
+    await collection.create_index([("shop_id", 1), ("id", 1)], unique=True)
+    await collection.create_index([("shop_id", 1), ("created_at", -1)])
+    await collection.create_index([("shop_id", 1), ("customer_phone", 1), ("bill_type", 1), ("created_at", 1), ("id", 1)])
+
+@job_handler("archive_bills")
+async def run_archive_bills(ctx: JobContext, params: Dict[str, Any]):
+    shop = ctx.shop
+    cutoff = datetime.utcnow() - timedelta(days=params["older_than_days"])
+    candidates = shop.scope(closed_bill_filter(cutoff))
+    total = await shop.db.bills.count_documents(candidates)
+    if total == 0:
+        return {"archived": 0, "years": []}
+
+    # Publish the new layout first and give every worker time to reload it,
+    # so no reader misses a bill once it has left the live collection
+    years_pipeline = [
+        {"$match": candidates},
+        {"$group": {"_id": {"$year": "$created_at"}}},
+    ]
+    years = sorted(row["_id"] for row in await shop.db.bills.aggregate(years_pipeline).to_list(None))
+    for year in years:
+        await ensure_archive_indexes(archive_collection(shop, year))
+    state = await get_archive_state(shop, refresh=True)
+    archived_before = max(cutoff, state["archived_before"]) if state["archived_before"] else cutoff
+    await shop.db.archive_state.update_one(
+        {"_id": archive_state_id(shop)},
+        {"$set": {"archived_before": archived_before}, "$addToSet": {"years": {"$each": years}}},
+        upsert=True,
+    )
+    await ctx.report(0, "Waiting for workers to load the archive layout")
+    await asyncio.sleep(ARCHIVE_STATE_TTL)
+
+    archived = 0
+    while True:
+        batch = await shop.db.bills.find(candidates).sort("created_at", 1).to_list(ARCHIVE_BATCH_SIZE)
+        if not batch:
+            break
+        by_year: Dict[int, List[Dict[str, Any]]] = {}
+        for bill in batch:
+            by_year.setdefault(bill["created_at"].year, []).append(bill)
+        # Copies are idempotent upserts, so a job interrupted between copy and delete can simply rerun
+        for year, bills in by_year.items():
+            await archive_collection(shop, year).bulk_write(
+                [ReplaceOne(shop.scope({"id": bill["id"]}), bill, upsert=True) for bill in bills],
+                ordered=False,
+            )
+        result = await shop.db.bills.delete_many({"$and": [candidates, {"id": {"$in": [bill["id"] for bill in batch]}}]})
+        archived += result.deleted_count
+        await ctx.report(min(archived / total, 1), f"Archived {archived} of {total} bills")
+
+    return {"archived": archived, "years": years, "archived_before": archived_before.isoformat()}
+
+# Bill numbering
+# Each shop numbers its bills per shop-local day from a counters document that
+# is incremented atomically, so concurrent checkouts never share a number and
+# numbering never scans the day's bills.
+async def next_bill_sequence(shop: Shop) -> int:
+    day_key = shop_now().strftime("%Y%m%d")
+    counter_id = f"{shop.id}:bill:{day_key}"
+    counter = await shop.db.counters.find_one_and_update(
+        {"_id": counter_id}, {"$inc": {"seq": 1}}, return_document=ReturnDocument.AFTER
+    )
+    if counter is None:
+        # Seed a new day's counter with any bills numbered before counters existed
+        day_start, day_end = get_date_range("today")
+        day_filter = shop.scope({"created_at": {"$gte": day_start, "$lt": day_end}})
+        audit_count("create_bill", shop.db.bills, day_filter)
+        existing = await shop.db.bills.count_documents(day_filter)
+        await shop.db.counters.update_one(
+            {"_id": counter_id},
+            {"$max": {"seq": existing}, "$setOnInsert": {"shop_id": shop.id, "day": day_key}},
+            upsert=True,
+        )
+        counter = await shop.db.counters.find_one_and_update(
+            {"_id": counter_id}, {"$inc": {"seq": 1}}, return_document=ReturnDocument.AFTER
+        )
+    return counter["seq"]
 
 # Authentication routes
 @api_router.post("/auth/login", response_model=LoginResponse)
 async def login(login_request: LoginRequest):
-    if not verify_credentials(login_request.username, login_request.password):
+    user = await verify_credentials(login_request.username, login_request.password)
+    if user is None:
         raise HTTPException(
             status_code=401,
             detail="Incorrect username or password"
@@ -205,155 +2312,151 @@ async def login(login_request: LoginRequest):
     
     access_token_expires = timedelta(minutes=ACCESS_TOKEN_EXPIRE_MINUTES)
     access_token = create_access_token(
-        data={"sub": login_request.username}, expires_delta=access_token_expires
+        data={"sub": user.username, "shop_id": user.shop_id, "role": user.role},
+        expires_delta=access_token_expires
     )
     
     return {
         "access_token": access_token,
         "token_type": "bearer",
-        "user": {"username": login_request.username}
+        "user": user.dict()
     }
 
 @api_router.get("/auth/verify")
-async def verify_auth(current_user: str = Depends(verify_token)):
-    return {"user": current_user, "valid": True}
+async def verify_auth(current_user: CurrentUser = Depends(verify_token)):
+    return {"user": current_user.username, "shop_id": current_user.shop_id, "role": current_user.role, "valid": True}
 
 # Item management routes
 @api_router.post("/items", response_model=Item)
-async def create_item(item: ItemCreate, current_user: str = Depends(verify_token)):
+async def create_item(item: ItemCreate, shop: Shop = Depends(get_shop)):
     item_dict = item.dict()
     item_obj = Item(**item_dict)
-    await db.items.insert_one(item_obj.dict())
+    await shop.db.items.insert_one(shop.scope(item_to_db(item_obj.dict())))
+    await invalidate_item_cache(shop)
+    if item_obj.stock_quantity:
+        await shop.db.stock_movements.insert_one(shop.scope(
+            StockMovement(item_id=item_obj.id, change=item_obj.stock_quantity, reason="adjustment", notes="Opening stock").dict()
+        ))
     return item_obj
 
 @api_router.get("/items", response_model=List[Item])
-async def get_items(current_user: str = Depends(verify_token)):
-    items = await db.items.find().sort("name", 1).to_list(1000)
-    return [Item(**item) for item in items]
+async def get_items(shop: Shop = Depends(get_shop)):
+    return await get_cached_items(shop)
 
 @api_router.get("/items/search/{query}")
-async def search_items(query: str, current_user: str = Depends(verify_token)):
-    regex_pattern = {"$regex": query, "$options": "i"}
-    items = await db.items.find({"name": regex_pattern}).sort("name", 1).to_list(50)
-    return [Item(**item) for item in items]
+async def search_items(query: str, shop: Shop = Depends(get_shop)):
+    search_filter = shop.scope({"name": {"$regex": query, "$options": "i"}})
+    audit_find("search_items", shop.db.items, search_filter, sort={"name": 1}, limit=50)
+    items = await shop.db.items.find(search_filter).sort("name", 1).to_list(50)
+    return [Item(**item_from_db(item)) for item in items]
 
 @api_router.put("/items/{item_id}", response_model=Item)
-async def update_item(item_id: str, item_update: ItemUpdate, current_user: str = Depends(verify_token)):
-    existing_item = await db.items.find_one({"id": item_id})
+async def update_item(item_id: str, item_update: ItemUpdate, shop: Shop = Depends(get_shop)):
+    item_filter = shop.scope({"id": item_id})
+    existing_item = await shop.db.items.find_one(item_filter)
     if not existing_item:
         raise HTTPException(status_code=404, detail="Item not found")
     
     update_data = {k: v for k, v in item_update.dict().items() if v is not None}
     update_data["updated_at"] = datetime.utcnow()
     
-    await db.items.update_one({"id": item_id}, {"$set": update_data})
-    updated_item = await db.items.find_one({"id": item_id})
-    return Item(**updated_item)
+    await shop.db.items.update_one(item_filter, {"$set": item_to_db(update_data)})
+    await invalidate_item_cache(shop)
+    updated_item = await shop.db.items.find_one(item_filter)
+    return Item(**item_from_db(updated_item))
+
+@api_router.get("/items/low-stock", response_model=List[Item])
+async def get_low_stock_items(
+    threshold: int = LOW_STOCK_THRESHOLD,
+    limit: int = 100,
+    shop: Shop = Depends(get_shop)
+):
+    low_stock_filter = shop.scope({"stock_quantity": {"$lte": threshold}})
+    audit_find("get_low_stock_items", shop.db.items, low_stock_filter, sort={"stock_quantity": 1}, limit=limit)
+    items = await shop.db.items.find(low_stock_filter).sort("stock_quantity", 1).to_list(limit)
+    return [Item(**item_from_db(item)) for item in items]
+
+@api_router.post("/items/{item_id}/stock", response_model=Item)
+async def adjust_item_stock(item_id: str, adjustment: StockAdjustment, shop: Shop = Depends(get_shop)):
+    item_filter = shop.scope({"id": item_id})
+    existing_item = await shop.db.items.find_one(item_filter, {"id": 1})
+    if not existing_item:
+        raise HTTPException(status_code=404, detail="Item not found")
+    
+    await apply_stock_changes(shop, {item_id: adjustment.change}, "adjustment", notes=adjustment.notes)
+    updated_item = await shop.db.items.find_one(item_filter)
+    return Item(**item_from_db(updated_item))
+
+@api_router.get("/items/{item_id}/stock-movements", response_model=List[StockMovement])
+async def get_stock_movements(item_id: str, limit: int = 100, shop: Shop = Depends(get_shop)):
+    movement_filter = shop.scope({"item_id": item_id})
+    audit_find("get_stock_movements", shop.db.stock_movements, movement_filter, sort={"created_at": -1}, limit=limit)
+    movements = await shop.db.stock_movements.find(movement_filter).sort("created_at", -1).to_list(limit)
+    return [StockMovement(**movement) for movement in movements]
 
 @api_router.delete("/items/{item_id}")
-async def delete_item(item_id: str, current_user: str = Depends(verify_token)):
-    result = await db.items.delete_one({"id": item_id})
+async def delete_item(item_id: str, shop: Shop = Depends(get_shop)):
+    result = await shop.db.items.delete_one(shop.scope({"id": item_id}))
+    await invalidate_item_cache(shop)
     if result.deleted_count == 0:
         raise HTTPException(status_code=404, detail="Item not found")
     return {"message": "Item deleted successfully"}
 
 # Import/Export routes
-@api_router.post("/items/import")
-async def import_items(file: UploadFile = File(...), current_user: str = Depends(verify_token)):
+@api_router.post("/items/import", response_model=Job, status_code=202)
+async def import_items(file: UploadFile = File(...), shop: Shop = Depends(get_shop)):
     if not file.filename.endswith(('.csv', '.xlsx')):
         raise HTTPException(status_code=400, detail="File must be CSV or Excel format")
     
-    try:
-        content = await file.read()
-        
-        if file.filename.endswith('.csv'):
-            df = pd.read_csv(io.StringIO(content.decode('utf-8')))
-        else:
-            df = pd.read_excel(io.BytesIO(content))
-        
-        required_columns = ['name', 'cost_price', 'customer_price', 'carpenter_price']
-        if not all(col in df.columns for col in required_columns):
-            raise HTTPException(status_code=400, detail=f"Missing required columns: {required_columns}")
-        
-        items_created = 0
-        for _, row in df.iterrows():
-            item_data = {
-                'name': str(row['name']),
-                'cost_price': float(row['cost_price']),
-                'customer_price': float(row['customer_price']),
-                'carpenter_price': float(row['carpenter_price'])
-            }
-            item_obj = Item(**item_data)
-            await db.items.insert_one(item_obj.dict())
-            items_created += 1
-        
-        return {"message": f"Successfully imported {items_created} items"}
-    
-    except Exception as e:
-        raise HTTPException(status_code=400, detail=f"Error processing file: {str(e)}")
+    content = await file.read()
+    return await submit_job("import_items", shop, {"filename": file.filename}, content)
 
 @api_router.get("/items/export")
-async def export_items(current_user: str = Depends(verify_token)):
-    items = await db.items.find().to_list(1000)
-    
-    # Create DataFrame
-    df_data = []
-    for item in items:
-        df_data.append({
-            'name': item['name'],
-            'cost_price': item['cost_price'],
-            'customer_price': item['customer_price'],
-            'carpenter_price': item['carpenter_price'],
-            'created_at': item['created_at'].strftime('%Y-%m-%d %H:%M:%S')
-        })
-    
-    df = pd.DataFrame(df_data)
-    
-    # Convert to CSV
-    output = io.StringIO()
-    df.to_csv(output, index=False)
-    output.seek(0)
+async def export_items(shop: Shop = Depends(get_reporting_shop)):
+    audit_find("export_items", shop.db.items, shop.scope(), limit=1000)
+    rows = await fetch_export_rows(shop)
+    data = await run_in_job_pool(render_items_csv, rows)
     
     return StreamingResponse(
-        io.BytesIO(output.getvalue().encode()),
+        io.BytesIO(data),
         media_type="text/csv",
         headers={"Content-Disposition": "attachment; filename=items_export.csv"}
     )
 
+@api_router.post("/items/export", response_model=Job, status_code=202)
+async def submit_export_items(shop: Shop = Depends(get_shop)):
+    return await submit_job("export_items", shop)
+
 # Bill management routes
 @api_router.post("/bills", response_model=Bill)
-async def create_bill(bill: BillCreate, current_user: str = Depends(verify_token)):
+async def create_bill(bill: BillCreate, shop: Shop = Depends(get_shop)):
     # Generate bill number
-    today = datetime.utcnow()
-    bill_count = await db.bills.count_documents({
-        "created_at": {
-            "$gte": datetime(today.year, today.month, today.day),
-            "$lt": datetime(today.year, today.month, today.day) + timedelta(days=1)
-        }
-    })
-    bill_number = f"BILL-{today.strftime('%Y%m%d')}-{bill_count + 1:03d}"
+    bill_sequence = await next_bill_sequence(shop)
+    bill_number = f"BILL-{shop_now().strftime('%Y%m%d')}-{bill_sequence:03d}"
     
     # Calculate total profit from items
-    total_profit = sum(item.profit for item in bill.items)
+    total_profit = from_minor(sum(to_minor(item.profit) for item in bill.items))
     
     # Calculate remaining balance for credit bills
     remaining_balance = None
     if bill.bill_type == "credit":
-        remaining_balance = bill.total_amount - bill.amount_paid
+        remaining_balance = from_minor(to_minor(bill.total_amount) - to_minor(bill.amount_paid))
     
     # Check if customer already has credit bills (merge logic)
     if bill.bill_type == "credit" and bill.customer_phone:
-        existing_bills = await db.bills.find({
+        open_credit_filter = shop.scope({
             "customer_phone": bill.customer_phone,
             "bill_type": "credit",
             "remaining_balance": {"$gt": 0}
-        }).to_list(100)
+        })
+        audit_find("create_bill", shop.db.bills, open_credit_filter, limit=100)
+        existing_bills = await shop.db.bills.find(open_credit_filter).to_list(100)
         
         if existing_bills:
             # Update customer name if provided
             if bill.customer_name:
-                await db.bills.update_many(
-                    {"customer_phone": bill.customer_phone},
+                await shop.db.bills.update_many(
+                    shop.scope({"customer_phone": bill.customer_phone}),
                     {"$set": {"customer_name": bill.customer_name}}
                 )
     
@@ -363,7 +2466,15 @@ async def create_bill(bill: BillCreate, current_user: str = Depends(verify_token
     bill_dict["remaining_balance"] = remaining_balance
     
     bill_obj = Bill(**bill_dict)
-    await db.bills.insert_one(bill_obj.dict())
+    
+    # Take the sold quantities out of stock before the bill is recorded
+    stock_changes = stock_changes_for_items(bill_dict["items"], -1)
+    await apply_stock_changes(shop, stock_changes, "sale", bill_id=bill_obj.id)
+    try:
+        await shop.db.bills.insert_one(shop.scope(bill_to_db(bill_obj.dict())))
+    except Exception:
+        await apply_stock_changes(shop, {k: -v for k, v in stock_changes.items()}, "sale_reversal", bill_id=bill_obj.id, guard=False)
+        raise
     return bill_obj
 
 @api_router.get("/bills", response_model=List[Bill])
@@ -372,9 +2483,9 @@ async def get_bills(
     bill_type: Optional[str] = None,
     start_date: Optional[datetime] = None,
     end_date: Optional[datetime] = None,
-    current_user: str = Depends(verify_token)
+    shop: Shop = Depends(get_shop)
 ):
-    query = {}
+    query = shop.scope()
     
     if search:
         query["$or"] = [
@@ -390,91 +2501,168 @@ async def get_bills(
     if start_date and end_date:
         query["created_at"] = {"$gte": start_date, "$lte": end_date}
     
-    bills = await db.bills.find(query).sort("created_at", -1).to_list(1000)
-    return [Bill(**bill) for bill in bills]
+    audit_find("get_bills", shop.db.bills, query, sort={"created_at": -1}, limit=1000)
+    bills = await shop.db.bills.find(query).sort("created_at", -1).to_list(1000)
+    
+    # Archives only hold bills older than the cutoff, so they can be skipped
+    # when the live collection already filled the page with newer bills
+    date_range = (start_date, end_date) if start_date and end_date else (None, None)
+    collections = await bill_collections(shop, *date_range)
+    state = await get_archive_state(shop)
+    if len(collections) > 1 and not (len(bills) == 1000 and bills[-1]["created_at"] >= state["archived_before"]):
+        for collection in collections[1:]:
+            bills += await collection.find(query).sort("created_at", -1).to_list(1000)
+        bills = sorted(bills, key=lambda bill: bill["created_at"], reverse=True)[:1000]
+    return [Bill(**bill_from_db(bill)) for bill in bills]
 
 @api_router.get("/bills/{bill_id}", response_model=Bill)
-async def get_bill(bill_id: str, current_user: str = Depends(verify_token)):
-    bill = await db.bills.find_one({"id": bill_id})
+async def get_bill(bill_id: str, shop: Shop = Depends(get_shop)):
+    bill = await find_bill(shop, bill_id, "get_bill")
+    if not bill:
+        raise HTTPException(status_code=404, detail="Bill not found")
+    return Bill(**bill_from_db(bill))
+
+@api_router.get("/bills/{bill_id}/invoice.pdf")
+async def get_bill_invoice(bill_id: str, shop: Shop = Depends(get_shop)):
+    bill = await find_bill(shop, bill_id, "get_bill_invoice")
     if not bill:
         raise HTTPException(status_code=404, detail="Bill not found")
-    return Bill(**bill)
+    
+    shop_name = await get_shop_name(shop)
+    pages = await render_invoice_pages([{**Bill(**bill_from_db(bill)).dict(), "shop_name": shop_name}])
+    return Response(
+        content=assemble_pdf(pages[0]),
+        media_type="application/pdf",
+        headers={"Content-Disposition": f"inline; filename={bill['bill_number']}.pdf"}
+    )
+
+@api_router.post("/bills/invoices.pdf")
+async def get_bill_invoices(batch: InvoiceBatchRequest, shop: Shop = Depends(get_shop)):
+    query = shop.scope()
+    if batch.bill_ids:
+        query["id"] = {"$in": batch.bill_ids}
+    if batch.customer_phone:
+        query["customer_phone"] = batch.customer_phone
+    if batch.bill_type:
+        query["bill_type"] = batch.bill_type
+    if not batch.bill_ids and not batch.customer_phone:
+        raise HTTPException(status_code=400, detail="Provide bill_ids or customer_phone")
+    
+    audit_find("get_bill_invoices", shop.db.bills, query, sort={"created_at": 1}, limit=PDF_BATCH_LIMIT + 1)
+    bills = []
+    for collection in await bill_collections(shop):
+        bills += await collection.find(query).sort("created_at", 1).to_list(PDF_BATCH_LIMIT + 1 - len(bills))
+        if len(bills) > PDF_BATCH_LIMIT:
+            break
+    bills.sort(key=lambda bill: bill["created_at"])
+    if not bills:
+        raise HTTPException(status_code=404, detail="No bills found")
+    if len(bills) > PDF_BATCH_LIMIT:
+        raise HTTPException(status_code=400, detail=f"Cannot render more than {PDF_BATCH_LIMIT} bills at once")
+    
+    shop_name = await get_shop_name(shop)
+    rendered = await render_invoice_pages([{**Bill(**bill_from_db(bill)).dict(), "shop_name": shop_name} for bill in bills])
+    filename = f"statement_{batch.customer_phone}.pdf" if batch.customer_phone else "invoices.pdf"
+    return Response(
+        content=assemble_pdf([page for pages in rendered for page in pages]),
+        media_type="application/pdf",
+        headers={"Content-Disposition": f"inline; filename={filename}"}
+    )
 
 @api_router.put("/bills/{bill_id}", response_model=Bill)
-async def update_bill(bill_id: str, bill_update: BillUpdate, current_user: str = Depends(verify_token)):
-    existing_bill = await db.bills.find_one({"id": bill_id})
+async def update_bill(bill_id: str, bill_update: BillUpdate, shop: Shop = Depends(get_shop)):
+    bill_filter = shop.scope({"id": bill_id})
+    audit_find("update_bill", shop.db.bills, bill_filter, limit=1)
+    existing_bill = await shop.db.bills.find_one(bill_filter)
     if not existing_bill:
-        raise HTTPException(status_code=404, detail="Bill not found")
+        await raise_missing_bill(shop, bill_id)
     
-    update_data = {k: v for k, v in bill_update.dict().items() if v is not None}
+    update_data = bill_to_db({k: v for k, v in bill_update.dict().items() if v is not None})
     update_data["updated_at"] = datetime.utcnow()
     
-    # Recalculate profit if items are updated
+    # Recalculate profit and move the quantity difference in or out of stock if items are updated
+    stock_changes = {}
     if "items" in update_data:
         total_profit = sum(item["profit"] for item in update_data["items"])
         update_data["profit"] = total_profit
+        stock_changes = merge_stock_changes(
+            stock_changes_for_items(existing_bill["items"], 1),
+            stock_changes_for_items(update_data["items"], -1),
+        )
+        await apply_stock_changes(shop, stock_changes, "bill_update", bill_id=bill_id)
     
     # Recalculate remaining balance if amounts are updated
     if "total_amount" in update_data or "amount_paid" in update_data:
-        total_amount = update_data.get("total_amount", existing_bill["total_amount"])
-        amount_paid = update_data.get("amount_paid", existing_bill["amount_paid"])
+        total_amount = update_data.get("total_amount", stored_minor(existing_bill["total_amount"]))
+        amount_paid = update_data.get("amount_paid", stored_minor(existing_bill["amount_paid"]))
         if existing_bill["bill_type"] == "credit":
             update_data["remaining_balance"] = total_amount - amount_paid
     
-    await db.bills.update_one({"id": bill_id}, {"$set": update_data})
-    updated_bill = await db.bills.find_one({"id": bill_id})
-    return Bill(**updated_bill)
+    # The stock difference and balance were worked out from the bill as read;
+    # only write if nobody has changed it since, otherwise undo the stock move
+    result = await shop.db.bills.update_one(
+        {**bill_filter, "updated_at": existing_bill.get("updated_at")},
+        {"$set": update_data},
+    )
+    if result.matched_count == 0:
+        await apply_stock_changes(shop, {k: -v for k, v in stock_changes.items()}, "bill_update_reversal", bill_id=bill_id, guard=False)
+        raise HTTPException(status_code=409, detail="Bill was changed by another request; reload it and try again")
+    updated_bill = await shop.db.bills.find_one(bill_filter)
+    return Bill(**bill_from_db(updated_bill))
 
 @api_router.delete("/bills/{bill_id}")
-async def delete_bill(bill_id: str, current_user: str = Depends(verify_token)):
-    result = await db.bills.delete_one({"id": bill_id})
-    if result.deleted_count == 0:
-        raise HTTPException(status_code=404, detail="Bill not found")
+async def delete_bill(bill_id: str, shop: Shop = Depends(get_shop)):
+    bill = await shop.db.bills.find_one_and_delete(shop.scope({"id": bill_id}))
+    if not bill:
+        await raise_missing_bill(shop, bill_id)
+    
+    # Return the bill's quantities to stock
+    await apply_stock_changes(shop, stock_changes_for_items(bill["items"], 1), "bill_delete", bill_id=bill_id, guard=False)
     return {"message": "Bill deleted successfully"}
 
 # Credit management routes
 @api_router.get("/credits/customers", response_model=List[CreditCustomer])
-async def get_credit_customers(current_user: str = Depends(verify_token)):
+async def get_credit_customers(shop: Shop = Depends(get_reporting_shop)):
     # Aggregate credit customers
     pipeline = [
-        {"$match": {"bill_type": "credit", "customer_phone": {"$ne": None}}},
-        {
-            "$group": {
-                "_id": "$customer_phone",
-                "customer_name": {"$first": "$customer_name"},
-                "total_amount": {"$sum": "$total_amount"},
-                "paid_amount": {"$sum": "$amount_paid"},
-                "remaining_balance": {"$sum": "$remaining_balance"},
-                "last_payment_date": {"$max": "$updated_at"},
-                "bill_count": {"$sum": 1},
-                "bills": {"$push": "$id"}
-            }
-        },
+        {"$match": shop.scope({"bill_type": "credit", "customer_phone": {"$ne": None}})},
+        {"$group": CREDIT_CUSTOMER_GROUP},
         {"$match": {"remaining_balance": {"$gt": 0}}},
         {"$sort": {"remaining_balance": -1}}
     ]
     
-    result = await db.bills.aggregate(pipeline).to_list(100)
+    audit_aggregate("get_credit_customers", shop.db.bills, pipeline)
+    result = await shop.db.bills.aggregate(pipeline).to_list(100)
+    # Customers with a balance always have open bills here; their closed,
+    # archived bills are folded in so totals cover the whole history
+    result = await merge_archived_credit(shop, [customer["_id"] for customer in result], result, "get_credit_customers")
     
-    customers = []
-    for customer in result:
-        customers.append(CreditCustomer(
-            customer_phone=customer["_id"],
-            customer_name=customer["customer_name"] or "Unknown",
-            total_amount=customer["total_amount"],
-            paid_amount=customer["paid_amount"],
-            remaining_balance=customer["remaining_balance"],
-            last_payment_date=customer["last_payment_date"],
-            bill_count=customer["bill_count"],
-            bills=customer["bills"]
-        ))
+    return [credit_customer_from_group(customer) for customer in result]
+
+@api_router.get("/credits/aging", response_model=AgingReport)
+async def get_credit_aging(
+    edges: Optional[str] = None,
+    skip: int = 0,
+    limit: int = 50,
+    shop: Shop = Depends(get_reporting_shop)
+):
+    bucket_edges = parse_aging_edges(edges)
+    labels = aging_bucket_labels(bucket_edges)
+    skip = max(skip, 0)
+    limit = min(max(limit, 1), AGING_PAGE_LIMIT)
+    now = datetime.utcnow()
     
-    return customers
+    pipeline = aging_pipeline(shop, now, bucket_edges, labels, skip, limit)
+    audit_aggregate("get_credit_aging", shop.db.bills, pipeline)
+    result = await shop.db.bills.aggregate(pipeline, allowDiskUse=True).to_list(1)
+    return aging_report_from_result(result[0], now, bucket_edges, labels, skip, limit)
 
 @api_router.post("/credits/payment", response_model=Payment)
-async def add_payment(payment: PaymentCreate, current_user: str = Depends(verify_token)):
+async def add_payment(payment: PaymentCreate, shop: Shop = Depends(get_shop)):
     # Get the bill
-    bill = await db.bills.find_one({"id": payment.bill_id})
+    bill_filter = shop.scope({"id": payment.bill_id})
+    audit_find("add_payment", shop.db.bills, bill_filter, limit=1)
+    bill = await shop.db.bills.find_one(bill_filter)
     if not bill:
         raise HTTPException(status_code=404, detail="Bill not found")
     
@@ -484,8 +2672,9 @@ async def add_payment(payment: PaymentCreate, current_user: str = Depends(verify
     if payment.amount <= 0:
         raise HTTPException(status_code=400, detail="Payment amount must be greater than 0")
     
-    current_balance = bill.get("remaining_balance", 0)
-    if payment.amount > current_balance:
+    amount = to_minor(payment.amount)
+    current_balance = stored_minor(bill.get("remaining_balance")) or 0
+    if amount > current_balance:
         raise HTTPException(status_code=400, detail="Payment amount cannot exceed remaining balance")
     
     # Create payment record
@@ -497,14 +2686,14 @@ async def add_payment(payment: PaymentCreate, current_user: str = Depends(verify
         notes=payment.notes
     )
     
-    await db.payments.insert_one(payment_obj.dict())
+    await shop.db.payments.insert_one(shop.scope(payment_to_db(payment_obj.dict())))
     
     # Update bill
-    new_paid_amount = bill["amount_paid"] + payment.amount
-    new_remaining_balance = bill["total_amount"] - new_paid_amount
+    new_paid_amount = stored_minor(bill["amount_paid"]) + amount
+    new_remaining_balance = stored_minor(bill["total_amount"]) - new_paid_amount
     
-    await db.bills.update_one(
-        {"id": payment.bill_id},
+    await shop.db.bills.update_one(
+        bill_filter,
         {
             "$set": {
                 "amount_paid": new_paid_amount,
@@ -517,57 +2706,205 @@ async def add_payment(payment: PaymentCreate, current_user: str = Depends(verify
     return payment_obj
 
 @api_router.get("/credits/payments/{customer_phone}")
-async def get_customer_payments(customer_phone: str, current_user: str = Depends(verify_token)):
-    payments = await db.payments.find({"customer_phone": customer_phone}).sort("payment_date", -1).to_list(100)
-    return [Payment(**payment) for payment in payments]
+async def get_customer_payments(customer_phone: str, shop: Shop = Depends(get_shop)):
+    payment_filter = shop.scope({"customer_phone": customer_phone})
+    audit_find("get_customer_payments", shop.db.payments, payment_filter, sort={"payment_date": -1}, limit=100)
+    payments = await shop.db.payments.find(payment_filter).sort("payment_date", -1).to_list(100)
+    return [Payment(**payment_from_db(payment)) for payment in payments]
+
+@api_router.get("/credits/statement/{customer_phone}")
+async def get_credit_statement(
+    customer_phone: str,
+    start_date: Optional[datetime] = None,
+    end_date: Optional[datetime] = None,
+    cursor: Optional[str] = None,
+    limit: int = 100,
+    format: str = "json",
+    shop: Shop = Depends(get_reporting_shop)
+):
+    if format not in ("json", "ndjson", "csv"):
+        raise HTTPException(status_code=400, detail="Format must be json, ndjson or csv")
+    
+    decoded_cursor = decode_statement_cursor(cursor) if cursor else None
+    payment_totals = await statement_payment_totals(shop, customer_phone)
+    opening_balance = await statement_start_balance(shop, customer_phone, start_date, decoded_cursor, payment_totals)
+    entries = statement_entries(shop, customer_phone, opening_balance, payment_totals, start_date, end_date, decoded_cursor)
+    
+    if format == "json":
+        limit = min(max(limit, 1), STATEMENT_PAGE_LIMIT)
+        page = []
+        async for entry in entries:
+            page.append(entry)
+            if len(page) > limit:
+                break
+        await entries.aclose()
+        
+        next_cursor = None
+        if len(page) > limit:
+            page = page[:limit]
+            last = page[-1]
+            next_cursor = encode_statement_cursor(last["date"], last["entry_type"], last["id"], last["balance"])
+        closing_balance = page[-1]["balance"] if page else opening_balance
+        return StatementPage(
+            customer_phone=customer_phone,
+            opening_balance=from_minor(opening_balance),
+            closing_balance=from_minor(closing_balance),
+            entries=[present_statement_entry(entry) for entry in page],
+            next_cursor=next_cursor
+        )
+    
+    if format == "ndjson":
+        async def ndjson_rows():
+            async for entry in entries:
+                yield present_statement_entry(entry).json() + "\n"
+        
+        return StreamingResponse(ndjson_rows(), media_type="application/x-ndjson")
+    
+    async def csv_rows():
+        columns = list(StatementEntry.__fields__)
+        output = io.StringIO()
+        writer = csv.writer(output)
+        writer.writerow(columns)
+        async for entry in entries:
+            row = present_statement_entry(entry).dict()
+            # Dates are stored in UTC; the CSV is read by people, so show shop time
+            row["date"] = utc_to_shop(row["date"]).strftime('%Y-%m-%d %H:%M:%S')
+            writer.writerow([row[column] for column in columns])
+            yield output.getvalue()
+            output.seek(0)
+            output.truncate()
+        yield output.getvalue()
+    
+    return StreamingResponse(
+        csv_rows(),
+        media_type="text/csv",
+        headers={"Content-Disposition": f"attachment; filename=statement_{customer_phone}.csv"}
+    )
 
 # Analytics routes
 @api_router.post("/analytics/stats")
-async def get_analytics_stats(query: AnalyticsQuery, current_user: str = Depends(verify_token)):
+async def get_analytics_stats(query: AnalyticsQuery, shop: Shop = Depends(get_reporting_shop)):
     start_date, end_date = get_date_range(query.period, query.start_date, query.end_date)
     
     # Get bills in date range
-    bills = await db.bills.find({
-        "created_at": {"$gte": start_date, "$lt": end_date}
-    }).to_list(1000)
+    range_filter = shop.scope({"created_at": {"$gte": start_date, "$lt": end_date}})
+    audit_find("get_analytics_stats", shop.db.bills, range_filter, limit=1000)
+    bills = []
+    for collection in await bill_collections(shop, start_date, end_date):
+        bills += await collection.find(range_filter).to_list(1000)
     
-    total_sales = sum(bill.get("total_amount", 0) for bill in bills)
-    total_profit = sum(bill.get("profit", 0) for bill in bills)
+    total_sales = sum(stored_minor(bill.get("total_amount", 0)) for bill in bills)
+    total_profit = sum(stored_minor(bill.get("profit", 0)) for bill in bills)
     paid_bills = [bill for bill in bills if bill.get("bill_type") == "paid"]
     credit_bills = [bill for bill in bills if bill.get("bill_type") == "credit"]
     
     # Get overall outstanding amount (not just for this period)
-    all_credit_bills = await db.bills.find({"bill_type": "credit", "remaining_balance": {"$gt": 0}}).to_list(1000)
-    outstanding_amount = sum(bill.get("remaining_balance", 0) for bill in all_credit_bills)
+    outstanding_filter = shop.scope({"bill_type": "credit", "remaining_balance": {"$gt": 0}})
+    audit_find("get_analytics_stats", shop.db.bills, outstanding_filter, limit=1000)
+    all_credit_bills = await shop.db.bills.find(outstanding_filter).to_list(1000)
+    outstanding_amount = sum(stored_minor(bill.get("remaining_balance", 0)) for bill in all_credit_bills)
     
     return {
         "period": query.period,
         "start_date": start_date.isoformat(),
         "end_date": end_date.isoformat(),
-        "total_sales": total_sales,
-        "total_profit": total_profit,
-        "outstanding_amount": outstanding_amount,
+        "total_sales": from_minor(total_sales),
+        "total_profit": from_minor(total_profit),
+        "outstanding_amount": from_minor(outstanding_amount),
         "bills_count": len(bills),
         "paid_bills_count": len(paid_bills),
         "credit_bills_count": len(credit_bills),
-        "paid_bills_amount": sum(bill.get("total_amount", 0) for bill in paid_bills),
-        "credit_bills_amount": sum(bill.get("total_amount", 0) for bill in credit_bills),
-        "average_bill_amount": total_sales / len(bills) if bills else 0,
+        "paid_bills_amount": from_minor(sum(stored_minor(bill.get("total_amount", 0)) for bill in paid_bills)),
+        "credit_bills_amount": from_minor(sum(stored_minor(bill.get("total_amount", 0)) for bill in credit_bills)),
+        "average_bill_amount": from_minor(total_sales) / len(bills) if bills else 0,
         "profit_margin": (total_profit / total_sales * 100) if total_sales > 0 else 0
     }
 
+@api_router.get("/analytics/timeseries", response_model=TimeSeriesResponse)
+async def get_analytics_timeseries(
+    granularity: str = "day",
+    period: str = "year",
+    start_date: Optional[datetime] = None,
+    end_date: Optional[datetime] = None,
+    shop: Shop = Depends(get_reporting_shop)
+):
+    if granularity not in TIMESERIES_GRANULARITIES:
+        raise HTTPException(status_code=400, detail=f"Granularity must be one of {list(TIMESERIES_GRANULARITIES)}")
+    
+    # An explicit window wins over the default period
+    if start_date and end_date:
+        period = "custom"
+    start, end = get_date_range(period, start_date, end_date)
+    buckets = iterate_buckets(start, end, granularity)
+    
+    truncate = {"date": "$created_at", "unit": granularity, "timezone": SHOP_TIMEZONE}
+    if granularity == "week":
+        truncate["startOfWeek"] = "monday"
+    pipeline = [
+        {"$match": shop.scope({"created_at": {"$gte": start, "$lt": end}})},
+        {
+            "$group": {
+                "_id": {"$dateTrunc": truncate},
+                "sales": {"$sum": minor_expr("total_amount")},
+                "profit": {"$sum": minor_expr("profit")},
+                "bill_count": {"$sum": 1},
+                "paid_amount": {"$sum": {"$cond": [{"$eq": ["$bill_type", "paid"]}, minor_expr("total_amount"), 0]}},
+                "paid_count": {"$sum": {"$cond": [{"$eq": ["$bill_type", "paid"]}, 1, 0]}},
+                "credit_amount": {"$sum": {"$cond": [{"$eq": ["$bill_type", "credit"]}, minor_expr("total_amount"), 0]}},
+                "credit_count": {"$sum": {"$cond": [{"$eq": ["$bill_type", "credit"]}, 1, 0]}},
+            }
+        },
+    ]
+    audit_aggregate("get_analytics_timeseries", shop.db.bills, pipeline)
+    rows: Dict[datetime, Dict[str, Any]] = {}
+    for collection in await bill_collections(shop, start, end):
+        for row in await collection.aggregate(pipeline).to_list(None):
+            bucket = rows.setdefault(row["_id"], {})
+            for field, value in row.items():
+                if field != "_id":
+                    bucket[field] = bucket.get(field, 0) + value
+    
+    label_formats = {"hour": "%Y-%m-%d %H:00", "day": "%Y-%m-%d", "week": "%Y-%m-%d", "month": "%Y-%m"}
+    points = []
+    for local_start in buckets:
+        bucket_start = shop_to_utc(local_start)
+        row = rows.get(bucket_start, {})
+        points.append(TimeSeriesPoint(
+            bucket_start=bucket_start,
+            label=local_start.strftime(label_formats[granularity]),
+            sales=from_minor(row.get("sales", 0)),
+            profit=from_minor(row.get("profit", 0)),
+            bill_count=row.get("bill_count", 0),
+            paid_amount=from_minor(row.get("paid_amount", 0)),
+            paid_count=row.get("paid_count", 0),
+            credit_amount=from_minor(row.get("credit_amount", 0)),
+            credit_count=row.get("credit_count", 0)
+        ))
+    
+    return TimeSeriesResponse(
+        granularity=granularity,
+        timezone=SHOP_TIMEZONE,
+        start_date=start,
+        end_date=end,
+        points=points
+    )
+
 @api_router.get("/analytics/top-items")
 async def get_top_selling_items(
     start_date: Optional[datetime] = None,
     end_date: Optional[datetime] = None,
     limit: int = 10,
-    current_user: str = Depends(verify_token)
+    shop: Shop = Depends(get_reporting_shop)
 ):
-    query = {}
+    query = shop.scope()
     if start_date and end_date:
         query["created_at"] = {"$gte": start_date, "$lte": end_date}
     
-    bills = await db.bills.find(query).to_list(1000)
+    audit_find("get_top_selling_items", shop.db.bills, query, limit=1000)
+    bills = []
+    date_range = (start_date, end_date) if start_date and end_date else (None, None)
+    for collection in await bill_collections(shop, *date_range):
+        bills += await collection.find(query).to_list(1000)
     
     # Aggregate item sales
     item_stats = {}
@@ -583,17 +2920,230 @@ async def get_top_selling_items(
                 }
             
             item_stats[item_name]["quantity_sold"] += item["quantity"]
-            item_stats[item_name]["total_revenue"] += item["subtotal"]
-            item_stats[item_name]["total_profit"] += item["profit"]
+            item_stats[item_name]["total_revenue"] += stored_minor(item["subtotal"])
+            item_stats[item_name]["total_profit"] += stored_minor(item["profit"])
     
     # Sort by revenue and return top items
     top_items = sorted(item_stats.values(), key=lambda x: x["total_revenue"], reverse=True)[:limit]
+    for stats in top_items:
+        stats["total_revenue"] = from_minor(stats["total_revenue"])
+        stats["total_profit"] = from_minor(stats["total_profit"])
     
     return top_items
 
+# Live dashboard routes
+@api_router.post("/live/token")
+async def issue_stream_token(current_user: CurrentUser = Depends(verify_token)):
+    token = create_access_token(
+        data={"sub": current_user.username, "shop_id": current_user.shop_id, "role": current_user.role, "scope": "stream"},
+        expires_delta=timedelta(seconds=LIVE_STREAM_TOKEN_SECONDS)
+    )
+    return {"token": token, "expires_in": LIVE_STREAM_TOKEN_SECONDS}
+
+@api_router.get("/live/stream")
+async def live_stream(request: Request, shop: Shop = Depends(get_stream_shop)):
+    live_feed = get_live_feed(shop)
+    queue = await live_feed.subscribe()
+    
+    async def events():
+        try:
+            snapshot = live_feed.snapshot()
+            yield f"event: snapshot\ndata: {json.dumps(snapshot, default=str)}\n\n"
+            while not await request.is_disconnected():
+                try:
+                    message = await asyncio.wait_for(queue.get(), timeout=LIVE_HEARTBEAT_INTERVAL)
+                except asyncio.TimeoutError:
+                    yield ": keep-alive\n\n"
+                    continue
+                if message is None:
+                    break
+                yield message
+        finally:
+            live_feed.unsubscribe(queue)
+    
+    return StreamingResponse(
+        events(),
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"}
+    )
+
+@api_router.get("/live/snapshot")
+async def live_snapshot(shop: Shop = Depends(get_shop)):
+    # Polling fallback for clients without EventSource. Reuse a running feed's
+    # totals, but do not start a change stream that no subscriber would stop
+    live_feed = live_feeds.get(shop.id)
+    if live_feed is not None and live_feed.subscribers and live_feed.totals is not None:
+        return live_feed.snapshot()
+    return {"totals": present_totals(await compute_today_totals(shop))}
+
+# Job routes
+@api_router.get("/jobs", response_model=List[Job])
+async def get_jobs(
+    job_type: Optional[str] = None,
+    status: Optional[str] = None,
+    limit: int = 50,
+    shop: Shop = Depends(get_shop)
+):
+    await expire_stale_jobs(shop.scope())
+    query = shop.scope()
+    if job_type:
+        query["job_type"] = job_type
+    if status:
+        query["status"] = status
+    
+    jobs = await db.jobs.find(query, {"output_data": 0}).sort("created_at", -1).to_list(limit)
+    return [Job(**job) for job in jobs]
+
+@api_router.get("/jobs/{job_id}", response_model=Job)
+async def get_job(job_id: str, shop: Shop = Depends(get_shop)):
+    # Polling a job whose worker died reports it failed instead of running forever
+    await expire_stale_jobs(shop.scope({"id": job_id}))
+    job = await db.jobs.find_one(shop.scope({"id": job_id}), {"output_data": 0})
+    if not job:
+        raise HTTPException(status_code=404, detail="Job not found")
+    return Job(**job)
+
+@api_router.get("/jobs/{job_id}/download")
+async def download_job_output(job_id: str, shop: Shop = Depends(get_shop)):
+    job = await db.jobs.find_one(shop.scope({"id": job_id}))
+    if not job:
+        raise HTTPException(status_code=404, detail="Job not found")
+    if job["status"] != "completed" or not job.get("output_data"):
+        raise HTTPException(status_code=409, detail="Job has no output to download")
+    
+    return StreamingResponse(
+        io.BytesIO(job["output_data"]),
+        media_type=job["output_media_type"],
+        headers={"Content-Disposition": f"attachment; filename={job['output_filename']}"}
+    )
+
+@api_router.post("/jobs/{job_id}/cancel", response_model=Job)
+async def cancel_job(job_id: str, shop: Shop = Depends(get_shop)):
+    job = await db.jobs.find_one_and_update(
+        shop.scope({"id": job_id, "status": {"$in": ["queued", "running"]}}),
+        {"$set": {"cancel_requested": True}},
+        projection={"output_data": 0},
+    )
+    if not job:
+        existing = await db.jobs.find_one(shop.scope({"id": job_id}), {"output_data": 0})
+        if not existing:
+            raise HTTPException(status_code=404, detail="Job not found")
+        return Job(**existing)
+    
+    task = running_jobs.get(job_id)
+    if task:
+        task.cancel()
+    job["cancel_requested"] = True
+    return Job(**job)
+
+# Admin routes
+@api_router.get("/admin/query-audit")
+async def get_query_audit(hot_only: bool = False, flush: bool = False, current_user: CurrentUser = Depends(verify_admin)):
+    if flush and _audit_tasks:
+        # Explains run after their request returns; wait for this worker's pending ones
+        await asyncio.gather(*list(_audit_tasks), return_exceptions=True)
+    # Shop admins only see their own shop's queries; superadmins see every shop
+    entries = [
+        e for e in query_audit_log.values()
+        if (e["hot"] or not hot_only) and (current_user.role == "superadmin" or e["shop_id"] == current_user.shop_id)
+    ]
+    entries.sort(key=lambda e: (not e["hot"], -e["collscans"], -e["max_examined_ratio"]))
+    regressions = [e for e in entries if e["hot"] and e["last_plan"]["collscan"]]
+    return {
+        "enabled": QUERY_AUDIT_ENABLED,
+        "sample_rate": QUERY_AUDIT_SAMPLE_RATE,
+        "entries": entries,
+        "regressions": regressions,
+    }
+
+@api_router.post("/admin/users")
+async def create_user(user: UserCreate, current_user: CurrentUser = Depends(verify_admin)):
+    if not SHOP_ID_PATTERN.match(user.shop_id):
+        raise HTTPException(status_code=400, detail="shop_id must be 1-32 lowercase letters, digits, '-' or '_'")
+    if user.role not in ("staff", "admin", "superadmin"):
+        raise HTTPException(status_code=400, detail="Role must be staff, admin or superadmin")
+    if current_user.role != "superadmin" and (user.shop_id != current_user.shop_id or user.role == "superadmin"):
+        raise HTTPException(status_code=403, detail="Admins can only create staff and admins in their own shop")
+    
+    try:
+        await store_user(CurrentUser(username=user.username, shop_id=user.shop_id, role=user.role), user.password)
+    except DuplicateKeyError:
+        raise HTTPException(status_code=409, detail="Username already exists")
+    
+    await register_shop(user.shop_id, user.shop_name)
+    return {"username": user.username, "shop_id": user.shop_id, "role": user.role}
+
+@api_router.get("/admin/read-routing")
+async def get_read_routing(shop: Shop = Depends(get_admin_shop)):
+    # Shows which member answers each read class, to check routing against a replica set
+    routing = {}
+    for read_class in READ_CLASSES:
+        database = shop_database(shop.id, read_class)
+        hello = await database.command("hello", read_preference=database.read_preference)
+        routing[read_class] = {
+            "read_preference": database.read_preference.document,
+            "served_by": hello.get("me"),
+            "secondary": hello.get("secondary", False),
+            "replica_set": hello.get("setName"),
+        }
+    return {"analytics_url": bool(ANALYTICS_MONGO_URL), "max_staleness": REPORTING_MAX_STALENESS, "read_classes": routing}
+
+@api_router.post("/admin/migrations/money")
+async def migrate_money(current_user: CurrentUser = Depends(verify_superadmin)):
+    # The migration rewrites every shop's data, so only superadmins may start it
+    job = await start_money_migration(Shop(current_user.shop_id, current_user.username))
+    if job is None:
+        return {"message": "All amounts are already stored in minor units"}
+    return job
+
+@api_router.get("/admin/archive")
+async def get_archive_status(shop: Shop = Depends(get_admin_shop)):
+    state = await get_archive_state(shop, refresh=True)
+    counts = {"bills": await shop.db.bills.count_documents(shop.scope())}
+    for year in state["years"]:
+        counts[f"{ARCHIVE_COLLECTION_PREFIX}{year}"] = await archive_collection(shop, year).count_documents(shop.scope())
+    return {"archived_before": state["archived_before"], "years": state["years"], "counts": counts}
+
+@api_router.post("/admin/archive/bills", response_model=Job, status_code=202)
+async def archive_bills(older_than_days: int = ARCHIVE_AFTER_DAYS, shop: Shop = Depends(get_admin_shop)):
+    if older_than_days < 1:
+        raise HTTPException(status_code=400, detail="older_than_days must be at least 1")
+    return await submit_job("archive_bills", shop, {"older_than_days": older_than_days})
+
+@api_router.get("/admin/startup")
+async def get_startup_report(current_user: CurrentUser = Depends(verify_admin)):
+    return startup_report
+
+@api_router.delete("/admin/query-audit")
+async def reset_query_audit(current_user: CurrentUser = Depends(verify_admin)):
+    if current_user.role == "superadmin":
+        query_audit_log.clear()
+    else:
+        for key in [k for k, e in query_audit_log.items() if e["shop_id"] == current_user.shop_id]:
+            query_audit_log.pop(key)
+    return {"message": "Query audit log cleared"}
+
 # Include the router in the main app
 app.include_router(api_router)
 
+@app.middleware("http")
+async def startup_timing_middleware(request, call_next):
+    response = await call_next(request)
+    if startup_report["first_request"] is None:
+        startup_report["first_request"] = _first_request_timing(request)
+    if startup_report["first_checkout"] is None and request.method == "POST" and request.url.path == "/api/bills":
+        startup_report["first_checkout"] = _first_request_timing(request)
+    return response
+
+@app.middleware("http")
+async def query_audit_middleware(request, call_next):
+    # Benchmarks send X-Query-Audit: force to explain every query the request issues
+    token = query_audit_forced.set(request.headers.get("x-query-audit") == "force")
+    try:
+        return await call_next(request)
+    finally:
+        query_audit_forced.reset(token)
+
 app.add_middleware(
     CORSMiddleware,
     allow_credentials=True,
@@ -609,10 +3159,136 @@ logging.basicConfig(
 )
 logger = logging.getLogger(__name__)
 
-@app.on_event("shutdown")
-async def shutdown_db_client():
+# Startup
+# Cold start timings (milliseconds) for this worker, served at GET /api/admin/startup.
+# Import and module times are measured from the first line of this module.
+def _ms_since(started: float) -> float:
+    return round((time.perf_counter() - started) * 1000, 1)
+
+startup_report: Dict[str, Any] = {
+    "mode": STARTUP_MODE,
+    "imports_ms": round((MODULE_IMPORTS_FINISHED - MODULE_IMPORT_STARTED) * 1000, 1),
+    "module_ms": _ms_since(MODULE_IMPORTS_FINISHED),
+    "steps": {},
+    "startup_ms": None,
+    "ready_ms": None,
+    "maintenance": "pending",
+    "maintenance_mode": None,
+    "first_request": None,
+    "first_checkout": None,
+}
+
+def _first_request_timing(request: Request) -> Dict[str, Any]:
+    return {"method": request.method, "path": request.url.path, "ms_since_import": _ms_since(MODULE_IMPORT_STARTED)}
+
+@asynccontextmanager
+async def timed_step(name: str):
+    started = time.perf_counter()
+    try:
+        yield
+    except Exception:
+        # A failed warm-up only costs the first request some latency, so keep starting
+        logger.exception(f"Startup step {name} failed")
+    finally:
+        startup_report["steps"][name] = _ms_since(started)
+
+async def warm_connection_pool():
+    # Concurrent pings open MONGO_MIN_POOL_SIZE connections (DNS, TLS and auth included)
+    # before the first request needs one
+    reporting = shop_database(DEFAULT_SHOP_ID, "reporting")
+    await asyncio.gather(
+        *(db.command("ping") for _ in range(MONGO_MIN_POOL_SIZE)),
+        *(reporting.command("ping", read_preference=reporting.read_preference) for _ in range(MONGO_MIN_POOL_SIZE)),
+    )
+
+async def prewarm_caches():
+    shop_ids = {DEFAULT_SHOP_ID, *await db.shops.distinct("shop_id")}
+    shops = [Shop(shop_id) for shop_id in shop_ids]
+    await asyncio.gather(
+        *(get_cached_items(shop) for shop in shops),
+        *(get_shop_name(shop) for shop in shops),
+        *(get_archive_state(shop) for shop in shops),
+    )
+
+async def schema_is_current() -> bool:
+    marker = await db.meta.find_one({"_id": "schema"})
+    return marker is not None and marker.get("version", 0) >= SCHEMA_VERSION
+
+async def run_startup_maintenance():
+    # Index creation and backfills are idempotent; the schema marker is only
+    # written once they have all succeeded against this version of the code
+    try:
+        started = time.perf_counter()
+        backfilled = await backfill_shop_ids()
+        startup_report["steps"]["backfill_shop_ids"] = _ms_since(started)
+        if backfilled:
+            # Caches warmed before the backfill could not see the default shop's legacy rows
+            await invalidate_item_cache(Shop(DEFAULT_SHOP_ID))
+        started = time.perf_counter()
+        await ensure_indexes()
+        startup_report["steps"]["ensure_indexes"] = _ms_since(started)
+        started = time.perf_counter()
+        await backfill_stock_levels()
+        await start_money_migration(Shop(DEFAULT_SHOP_ID, "system"))
+        startup_report["steps"]["backfills"] = _ms_since(started)
+        await db.meta.update_one(
+            {"_id": "schema"},
+            {"$max": {"version": SCHEMA_VERSION}, "$set": {"updated_at": datetime.utcnow()}},
+            upsert=True,
+        )
+        startup_report["maintenance"] = "completed"
+    except asyncio.CancelledError:
+        startup_report["maintenance"] = "cancelled"
+        raise
+    except Exception:
+        logger.exception("Startup maintenance failed")
+        startup_report["maintenance"] = "failed"
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    started = time.perf_counter()
+    maintenance = None
+    async with timed_step("connection_pool"):
+        await warm_connection_pool()
+    async with timed_step("stale_jobs"):
+        await expire_stale_jobs()
+    # Until maintenance has completed once for this schema version, legacy rows
+    # lack shop ids and indexes may be missing, so serving early would hide data
+    background = STARTUP_MODE != "full" and await schema_is_current()
+    startup_report["maintenance_mode"] = "background" if background else "blocking"
+    if not background:
+        await run_startup_maintenance()
+    async with timed_step("caches"):
+        await prewarm_caches()
+    if background:
+        maintenance = asyncio.create_task(run_startup_maintenance())
+    startup_report["startup_ms"] = _ms_since(started)
+    startup_report["ready_ms"] = _ms_since(MODULE_IMPORT_STARTED)
+    logger.info(
+        f"Worker ready in {startup_report['ready_ms']} ms "
+        f"(imports {startup_report['imports_ms']} ms, module {startup_report['module_ms']} ms, "
+        f"startup {startup_report['startup_ms']} ms: {startup_report['steps']})"
+    )
+
+    yield
+
+    tasks = list(running_jobs.values())
+    if maintenance is not None:
+        tasks.append(maintenance)
+    for task in tasks:
+        task.cancel()
+    await asyncio.gather(*tasks, return_exceptions=True)
+    await asyncio.gather(*(feed.stop() for feed in live_feeds.values()))
+    for executor in (_job_executor, _pdf_executor):
+        if executor is not None:
+            executor.shutdown(wait=False, cancel_futures=True)
+    if analytics_client is not client:
+        analytics_client.close()
     client.close()
 
+# The app is created before the routes it serves, so attach the lifespan here
+app.router.lifespan_context = lifespan
+
 if __name__ == "__main__":
     import uvicorn
     uvicorn.run("server:app", host="0.0.0.0", port=10000, reload=True)
@@ -1,6 +1,9 @@
+import base64
+import os
 import requests
 import sys
 import json
+import time
 from datetime import datetime
 
 class ShopBillingAPITester:
@@ -12,11 +15,12 @@ class ShopBillingAPITester:
         self.tests_passed = 0
         self.created_items = []
         self.created_bills = []
+        self.run_id = datetime.now().strftime('%H%M%S')
 
     def run_test(self, name, method, endpoint, expected_status, data=None, params=None):
         """Run a single API test"""
         url = f"{self.api_url}/{endpoint}"
-        headers = {'Content-Type': 'application/json'}
+        headers = {'Content-Type': 'application/json', 'X-Query-Audit': 'force'}
         if self.token:
             headers['Authorization'] = f'Bearer {self.token}'
 
@@ -65,7 +69,7 @@ class ShopBillingAPITester:
             "POST",
             "auth/login",
             200,
-            data={"username": "VVR", "password": "Vvr9704585785"}
+            data={"username": os.environ.get("TEST_USERNAME", ""), "password": os.environ.get("TEST_PASSWORD", "")}
         )
         if success and 'access_token' in response:
             self.token = response['access_token']
@@ -268,6 +272,458 @@ class ShopBillingAPITester:
             print(f"   Bills count: {response.get('bills_count', 0)}")
         return success
 
+    def test_query_audit(self):
+        """Test that hot routes are still served from an index"""
+        success, response = self.run_test(
+            "Query plan audit",
+            "GET",
+            "admin/query-audit",
+            200,
+            params={"hot_only": "true", "flush": "true"}
+        )
+        if not success:
+            return False
+        if not response.get('enabled'):
+            self.tests_passed -= 1
+            print("❌ Failed - query audit is disabled on the server, start it with QUERY_AUDIT=1")
+            return False
+        if not response.get('entries'):
+            self.tests_passed -= 1
+            print("❌ Failed - no hot queries were audited")
+            return False
+        regressions = response.get('regressions', [])
+        for entry in regressions:
+            print(f"   COLLSCAN on hot route {entry['route']} ({entry['namespace']}): {entry['query_shape']}")
+        if regressions:
+            self.tests_passed -= 1
+            print(f"❌ Failed - {len(regressions)} hot queries are not using an index")
+            return False
+        print(f"   {len(response.get('entries', []))} hot query shapes audited, all indexed")
+        return True
+
+    def test_shop_isolation(self):
+        """Test that a second shop cannot see this shop's items"""
+        # One fixed shop is reused across runs; 409 means an earlier run created it
+        user = {"username": "isolation_test", "password": os.environ.get("TEST_PASSWORD", ""), "shop_id": "isolation-test"}
+        response = self.request('POST', "admin/users", json=user)
+        if not self.check(f"Create or reuse user for another shop (status {response.status_code})", response.status_code in (200, 409)):
+            return False
+
+        main_token = self.token
+        self.token = None
+        success, response = self.run_test(
+            "Login as other shop",
+            "POST",
+            "auth/login",
+            200,
+            data={"username": user["username"], "password": user["password"]}
+        )
+        if not success:
+            self.token = main_token
+            return False
+
+        self.token = response['access_token']
+        success, items = self.run_test(
+            "Get items for other shop",
+            "GET",
+            "items",
+            200
+        )
+        self.token = main_token
+        if not success:
+            return False
+        leaked = [item for item in items if item['id'] in self.created_items]
+        if leaked:
+            self.tests_passed -= 1
+            print(f"❌ Failed - {len(leaked)} items leaked across shops")
+            return False
+        print(f"   Other shop sees {len(items)} items, none from this shop")
+        return True
+
+    def test_read_routing(self):
+        """Test that checkout reads stay on the primary"""
+        success, response = self.run_test(
+            "Read routing",
+            "GET",
+            "admin/read-routing",
+            200
+        )
+        if not success:
+            return False
+        for read_class, route in response.get('read_classes', {}).items():
+            role = "secondary" if route['secondary'] else "primary"
+            print(f"   {read_class}: {route['read_preference']} -> {route['served_by']} ({role})")
+        if response['read_classes']['primary']['secondary']:
+            self.tests_passed -= 1
+            print("❌ Failed - primary read class was served by a secondary")
+            return False
+        return True
+
+    def test_startup_report(self):
+        """Test that the worker reports its cold start timings"""
+        success, response = self.run_test(
+            "Startup report",
+            "GET",
+            "admin/startup",
+            200
+        )
+        if not success:
+            return False
+        print(f"   Ready in {response.get('ready_ms')} ms (imports {response.get('imports_ms')} ms, "
+              f"startup {response.get('startup_ms')} ms, maintenance {response.get('maintenance')})")
+        for step, elapsed in response.get('steps', {}).items():
+            print(f"   {step}: {elapsed} ms")
+        if response.get('ready_ms') is None or response.get('maintenance') == "failed":
+            self.tests_passed -= 1
+            print("❌ Failed - worker did not finish starting cleanly")
+            return False
+        return True
+
+    def request(self, method, endpoint, **kwargs):
+        """Send a raw request, for uploads and binary downloads run_test cannot check"""
+        headers = kwargs.pop('headers', {})
+        if self.token:
+            headers['Authorization'] = f'Bearer {self.token}'
+        return requests.request(method, f"{self.api_url}/{endpoint}", headers=headers, **kwargs)
+
+    def check(self, description, condition):
+        """Record one value check as its own test"""
+        self.tests_run += 1
+        if condition:
+            self.tests_passed += 1
+            print(f"✅ {description}")
+        else:
+            print(f"❌ Failed - {description}")
+        return condition
+
+    def create_stock_item(self, label, stock_quantity):
+        """Create an item with opening stock and remember it for cleanup"""
+        success, item = self.run_test(
+            f"Create {label} item",
+            "POST",
+            "items",
+            200,
+            data={
+                "name": f"{label} {self.run_id}",
+                "cost_price": 10.0,
+                "customer_price": 15.0,
+                "carpenter_price": 12.0,
+                "stock_quantity": stock_quantity
+            }
+        )
+        if not success:
+            return None
+        self.created_items.append(item['id'])
+        return item
+
+    def find_item(self, name):
+        """Read an item straight from the database (the item list may be cached)"""
+        success, items = self.run_test(f"Find item {name}", "GET", f"items/search/{name}", 200)
+        return next((item for item in items if item['name'] == name), None) if success else None
+
+    def bill_line(self, item, quantity, sale_price=None, profit=None):
+        sale_price = item['customer_price'] if sale_price is None else sale_price
+        return {
+            "item_id": item['id'],
+            "item_name": item['name'],
+            "cost_price": item['cost_price'],
+            "sale_price": sale_price,
+            "quantity": quantity,
+            "subtotal": round(sale_price * quantity, 2),
+            "profit": round((sale_price - item['cost_price']) * quantity, 2) if profit is None else profit
+        }
+
+    def paid_bill(self, lines):
+        total = round(sum(line['subtotal'] for line in lines), 2)
+        return {"items": lines, "pricing_mode": "customer", "total_amount": total, "amount_paid": total, "bill_type": "paid"}
+
+    def test_stock_tracking(self):
+        """Test that sales decrement stock and record movements"""
+        item = self.create_stock_item("Stock Item", 10)
+        if not item:
+            return False
+        self.stock_item = item
+
+        success, bill = self.run_test("Create bill selling 3", "POST", "bills", 200, data=self.paid_bill([self.bill_line(item, 3)]))
+        if not success:
+            return False
+        self.created_bills.append(bill['id'])
+
+        current = self.find_item(item['name'])
+        ok = self.check("Stock decremented from 10 to 7", current is not None and current['stock_quantity'] == 7)
+
+        success, movements = self.run_test("Get stock movements", "GET", f"items/{item['id']}/stock-movements", 200)
+        sale = [m for m in movements if m['reason'] == "sale" and m['bill_id'] == bill['id']] if success else []
+        ok = self.check("Sale recorded as a -3 stock movement", len(sale) == 1 and sale[0]['change'] == -3) and ok
+
+        success, _ = self.run_test("Adjust stock by -5", "POST", f"items/{item['id']}/stock", 200, data={"change": -5, "notes": "Test shrinkage"})
+        success, low = self.run_test("Get low-stock items", "GET", "items/low-stock", 200, params={"threshold": 5, "limit": 500})
+        listed = [i for i in low if i['id'] == item['id']] if success else []
+        ok = self.check("Item at stock 2 listed as low stock", len(listed) == 1 and listed[0]['stock_quantity'] == 2) and ok
+        return ok
+
+    def test_oversell(self):
+        """Test that an oversold bill is rejected with 409 and nothing is taken from stock"""
+        if not getattr(self, 'stock_item', None):
+            print("❌ No stock item to oversell")
+            return False
+        item = self.stock_item
+        scarce = self.create_stock_item("Scarce Item", 1)
+        if not scarce:
+            return False
+
+        self.tests_run += 1
+        print("\n🔍 Testing Oversell bill...")
+        response = self.request("POST", "bills", json=self.paid_bill([self.bill_line(item, 1), self.bill_line(scarce, 5)]))
+        after = self.find_item(item['name'])
+        after_scarce = self.find_item(scarce['name'])
+        if after is None or after_scarce is None:
+            return False
+        if response.status_code == 409:
+            self.tests_passed += 1
+            print(f"✅ Passed - Status: 409 ({response.json().get('detail')})")
+            return self.check(
+                "Rejected bill left both items' stock unchanged",
+                after['stock_quantity'] == 2 and after_scarce['stock_quantity'] == 1
+            )
+        if response.status_code != 200:
+            print(f"❌ Failed - Expected 409 or 200, got {response.status_code}")
+            return False
+
+        # Stock enforcement is off (STOCK_ENFORCE_NON_NEGATIVE=0): the sale goes
+        # through, so check the decrement and that deleting the bill returns it
+        self.tests_passed += 1
+        print("✅ Passed - Status: 200 (stock enforcement disabled on server)")
+        ok = self.check(
+            "Oversold stock went negative",
+            after['stock_quantity'] == 1 and after_scarce['stock_quantity'] == -4
+        )
+        self.run_test("Delete oversold bill", "DELETE", f"bills/{response.json()['id']}", 200)
+        restored = self.find_item(scarce['name'])
+        return self.check("Deleting the bill restored the stock", restored is not None and restored['stock_quantity'] == 1) and ok
+
+    def wait_for_job(self, job_id, timeout=60):
+        """Poll a background job until it finishes"""
+        deadline = time.time() + timeout
+        while time.time() < deadline:
+            response = self.request("GET", f"jobs/{job_id}")
+            if response.status_code != 200:
+                return None
+            job = response.json()
+            if job['status'] not in ("queued", "running"):
+                return job
+            time.sleep(1)
+        return None
+
+    def test_import_items(self):
+        """Test that a CSV import runs as a job, creates new items and restocks existing ones by name"""
+        if not getattr(self, 'stock_item', None):
+            print("❌ No stock item to restock")
+            return False
+        existing = self.find_item(self.stock_item['name'])
+        if existing is None:
+            return False
+        new_name = f"Imported Item {self.run_id}"
+        content = (
+            "name,cost_price,customer_price,carpenter_price,stock_quantity\n"
+            f"{existing['name']},10,15,12,4\n"
+            f"{new_name},20,30,25,5\n"
+        )
+
+        self.tests_run += 1
+        print("\n🔍 Testing Import items CSV...")
+        response = self.request("POST", "items/import", files={"file": ("items.csv", content, "text/csv")})
+        if response.status_code != 202:
+            print(f"❌ Failed - Expected 202, got {response.status_code}")
+            return False
+        self.tests_passed += 1
+        print("✅ Passed - Status: 202")
+
+        job = self.wait_for_job(response.json()['id'])
+        if not self.check("Import job completed", job is not None and job['status'] == "completed"):
+            return False
+        result = job['result']
+        ok = self.check(
+            "Import created 1 item and updated 1",
+            result['items_created'] == 1 and result['items_updated'] == 1
+        )
+        restocked = self.find_item(existing['name'])
+        ok = self.check(
+            "Existing item restocked by 4",
+            restocked is not None and restocked['stock_quantity'] == existing['stock_quantity'] + 4 and restocked['id'] == existing['id']
+        ) and ok
+        imported = self.find_item(new_name)
+        if imported:
+            self.created_items.append(imported['id'])
+        return self.check("New item created with stock 5", imported is not None and imported['stock_quantity'] == 5) and ok
+
+    def test_export_job(self):
+        """Test that an export job produces a downloadable CSV"""
+        success, job = self.run_test("Submit export job", "POST", "items/export", 202)
+        if not success:
+            return False
+        job = self.wait_for_job(job['id'])
+        if not self.check("Export job completed", job is not None and job['status'] == "completed"):
+            return False
+        response = self.request("GET", f"jobs/{job['id']}/download")
+        lines = response.text.splitlines() if response.status_code == 200 else []
+        ok = self.check(
+            "Export CSV has the item columns",
+            bool(lines) and lines[0].split(",")[:5] == ["name", "cost_price", "customer_price", "carpenter_price", "stock_quantity"]
+        )
+        current = self.find_item(self.stock_item['name'])
+        row = next((line.split(",") for line in lines if line.startswith(f"{self.stock_item['name']},")), None)
+        return self.check(
+            "Export CSV lists the stock item with its stock level",
+            row is not None and current is not None and int(row[4]) == current['stock_quantity']
+        ) and ok
+
+    def test_money_rounding(self):
+        """Test that amounts are exact to the paisa"""
+        item = self.create_stock_item("Credit Item", 100)
+        if not item:
+            return False
+        self.credit_item = item
+        self.customer_phone = f"7{datetime.now().strftime('%d%H%M%S')}"
+        bill_data = {
+            "items": [self.bill_line(item, 1, 60.0, 0.1), self.bill_line(item, 1, 40.0, 0.2)],
+            "pricing_mode": "customer",
+            "total_amount": 100.0,
+            "amount_paid": 33.27,
+            "bill_type": "credit",
+            "customer_name": "Rounding Customer",
+            "customer_phone": self.customer_phone
+        }
+        success, bill = self.run_test("Create credit bill paying 33.27 of 100", "POST", "bills", 200, data=bill_data)
+        if not success:
+            return False
+        self.created_bills.append(bill['id'])
+        ok = self.check("Profit 0.1 + 0.2 is exactly 0.3", bill['profit'] == 0.3)
+        ok = self.check("Remaining balance is exactly 66.73", bill['remaining_balance'] == 66.73) and ok
+
+        success, _ = self.run_test(
+            "Pay 16.73 against the bill",
+            "POST",
+            "credits/payment",
+            200,
+            data={"bill_id": bill['id'], "amount": 16.73}
+        )
+        success, current = self.run_test("Get paid-down bill", "GET", f"bills/{bill['id']}", 200)
+        ok = self.check("Remaining balance is exactly 50.0", success and current['remaining_balance'] == 50.0) and ok
+
+        success, customers = self.run_test("Get credit customers", "GET", "credits/customers", 200, params={"fresh": 1})
+        customer = next((c for c in customers if c['customer_phone'] == self.customer_phone), None) if success else None
+        return self.check(
+            "Credit customer totals 100.0 billed, 50.0 paid, 50.0 due",
+            customer is not None and (customer['total_amount'], customer['paid_amount'], customer['remaining_balance']) == (100.0, 50.0, 50.0)
+        ) and ok
+
+    def test_invoice_pdf(self):
+        """Test that a bill renders as a PDF"""
+        if not self.created_bills:
+            print("❌ No bill to render")
+            return False
+        response = self.request("GET", f"bills/{self.created_bills[0]}/invoice.pdf")
+        return self.check(
+            "Invoice is returned as a PDF document",
+            response.status_code == 200
+            and response.headers.get('content-type', '').startswith("application/pdf")
+            and response.content.startswith(b"%PDF")
+        )
+
+    def test_statement_pages(self):
+        """Test that statement pages chain by cursor with a continuous running balance"""
+        if not getattr(self, 'credit_item', None):
+            print("❌ No credit customer for a statement")
+            return False
+        second = {
+            "items": [self.bill_line(self.credit_item, 1, 25.5)],
+            "pricing_mode": "customer",
+            "total_amount": 25.5,
+            "amount_paid": 0,
+            "bill_type": "credit",
+            "customer_name": "Rounding Customer",
+            "customer_phone": self.customer_phone
+        }
+        success, bill = self.run_test("Create second credit bill", "POST", "bills", 200, data=second)
+        if not success:
+            return False
+        self.created_bills.append(bill['id'])
+
+        entries = []
+        pages = 0
+        # Reporting routes may read from a lagging secondary; fresh=1 reads back from the primary
+        params = {"limit": 1, "fresh": 1}
+        balance = None
+        continuous = True
+        while True:
+            success, page = self.run_test(f"Get statement page {pages + 1}", "GET", f"credits/statement/{self.customer_phone}", 200, params=params)
+            if not success:
+                return False
+            pages += 1
+            if balance is None:
+                balance = page['opening_balance']
+            continuous = continuous and page['opening_balance'] == balance
+            for entry in page['entries']:
+                balance = round(balance + entry['debit'] - entry['credit'], 2)
+                continuous = continuous and entry['balance'] == balance
+            entries.extend(page['entries'])
+            if not page['next_cursor'] or pages > 10:
+                break
+            params = {"limit": 1, "fresh": 1, "cursor": page['next_cursor']}
+
+        bad_cursor = base64.urlsafe_b64encode(json.dumps({"d": datetime.utcnow().isoformat(), "k": "refund", "i": "x", "b": 0}).encode()).decode()
+        self.run_test("Reject cursor with unknown entry kind", "GET", f"credits/statement/{self.customer_phone}", 400, params={"cursor": bad_cursor})
+
+        ok = self.check("Statement walked 3 entries one page at a time", len(entries) == 3 and pages >= 3)
+        ok = self.check("No entry repeated across pages", len({e['id'] for e in entries}) == len(entries)) and ok
+        ok = self.check("Running balance continuous across pages", continuous) and ok
+        return self.check("Statement closes at 75.5 due", balance == 75.5) and ok
+
+    def test_credit_aging(self):
+        """Test that today's credit bills land in the first aging bucket"""
+        if not getattr(self, 'customer_phone', None):
+            print("❌ No credit customer for aging")
+            return False
+        success, report = self.run_test("Get credit aging", "GET", "credits/aging", 200, params={"limit": 500, "fresh": 1})
+        if not success:
+            return False
+        first = report['bucket_labels'][0]
+        customer = next((c for c in report['customers'] if c['customer_phone'] == self.customer_phone), None)
+        ok = self.check(
+            f"Customer owes 75.5 over 2 bills, all in bucket {first}",
+            customer is not None and customer['total'] == 75.5 and customer['bill_count'] == 2
+            and customer['buckets'].get(first) == 75.5
+        )
+        return self.check(
+            "Bucket totals add up to the total outstanding",
+            round(sum(report['totals'].values()), 2) == report['total_outstanding']
+        ) and ok
+
+    def test_timeseries(self):
+        """Test that a new paid bill shows up in today's time series"""
+        if not getattr(self, 'credit_item', None):
+            print("❌ No item to sell")
+            return False
+
+        def today_totals():
+            success, series = self.run_test("Get today's time series", "GET", "analytics/timeseries", 200, params={"granularity": "day", "period": "today", "fresh": 1})
+            if not success:
+                return None
+            points = series['points']
+            return sum(p['bill_count'] for p in points), round(sum(p['sales'] for p in points), 2), round(sum(p['paid_amount'] for p in points), 2)
+
+        before = today_totals()
+        success, bill = self.run_test("Create paid bill for 45.0", "POST", "bills", 200, data=self.paid_bill([self.bill_line(self.credit_item, 3)]))
+        if not success or before is None:
+            return False
+        self.created_bills.append(bill['id'])
+        after = today_totals()
+        return self.check(
+            "Time series gained 1 bill and 45.0 in sales",
+            after is not None and after == (before[0] + 1, round(before[1] + 45.0, 2), round(before[2] + 45.0, 2))
+        )
+
     def test_delete_item(self):
         """Test deleting an item"""
         if not self.created_items:
@@ -314,6 +770,39 @@ def main():
     tester.test_create_bill_credit()
     tester.test_get_bills()
     tester.test_today_stats()
+    tester.test_invoice_pdf()
+    
+    # Stock Tests
+    print("\n📦 STOCK TESTS")
+    print("-" * 30)
+    tester.test_stock_tracking()
+    tester.test_oversell()
+    
+    # Background Job Tests
+    print("\n⏳ BACKGROUND JOB TESTS")
+    print("-" * 30)
+    tester.test_import_items()
+    tester.test_export_job()
+    
+    # Credit and Report Tests
+    print("\n💳 CREDIT AND REPORT TESTS")
+    print("-" * 30)
+    tester.test_money_rounding()
+    tester.test_statement_pages()
+    tester.test_credit_aging()
+    tester.test_timeseries()
+    
+    # Query Plan Tests
+    print("\n🔬 QUERY PLAN TESTS")
+    print("-" * 30)
+    tester.test_query_audit()
+    tester.test_read_routing()
+    tester.test_startup_report()
+    
+    # Tenancy Tests
+    print("\n🏬 TENANCY TESTS")
+    print("-" * 30)
+    tester.test_shop_isolation()
     
     # Cleanup Tests
     print("\n🧹 CLEANUP TESTS")
@@ -4,10 +4,54 @@ import axios from "axios";
 
 const BACKEND_URL = process.env.REACT_APP_BACKEND_URL;
 const API = `${BACKEND_URL}/api`;
+// Give up polling a background job after this long
+const JOB_POLL_TIMEOUT_MS = 10 * 60 * 1000;
 
 // Authentication context
 const AuthContext = React.createContext();
 
+// Wait before reopening a live feed that failed or dropped
+const LIVE_RECONNECT_MS = 3000;
+
+// Subscribe to the server's live dashboard feed; returns a cleanup function.
+// The stream URL carries a short-lived stream token rather than the login
+// token, so every (re)connect fetches a fresh one first.
+const subscribeLiveFeed = (handlers) => {
+  let source = null;
+  let closed = false;
+
+  const reconnect = () => {
+    if (!closed) setTimeout(connect, LIVE_RECONNECT_MS);
+  };
+
+  const connect = async () => {
+    try {
+      const token = localStorage.getItem("token");
+      const response = await axios.post(`${API}/live/token`, null, {
+        headers: { Authorization: `Bearer ${token}` }
+      });
+      if (closed) return;
+      source = new EventSource(`${API}/live/stream?token=${encodeURIComponent(response.data.token)}`);
+      Object.entries(handlers).forEach(([event, handler]) => {
+        source.addEventListener(event, (e) => handler(JSON.parse(e.data)));
+      });
+      // EventSource would retry with the same, by then expired, token
+      source.onerror = () => {
+        source.close();
+        reconnect();
+      };
+    } catch (error) {
+      reconnect();
+    }
+  };
+
+  connect();
+  return () => {
+    closed = true;
+    if (source) source.close();
+  };
+};
+
 // Login Component
 const Login = ({ onLogin }) => {
   const [credentials, setCredentials] = useState({ username: "", password: "" });
@@ -268,14 +312,31 @@ const ItemManagement = () => {
       const formData = new FormData();
       formData.append('file', file);
 
-      await axios.post(`${API}/items/import`, formData, {
+      const response = await axios.post(`${API}/items/import`, formData, {
         headers: { 
           Authorization: `Bearer ${token}`,
           'Content-Type': 'multipart/form-data'
         }
       });
 
-      alert("Items imported successfully!");
+      // Imports run as background jobs; poll until the job finishes
+      let job = response.data;
+      const deadline = Date.now() + JOB_POLL_TIMEOUT_MS;
+      while (job.status === "queued" || job.status === "running") {
+        if (Date.now() > deadline) {
+          throw new Error("The import is taking too long; check the item list again later");
+        }
+        await new Promise((resolve) => setTimeout(resolve, 1000));
+        const jobResponse = await axios.get(`${API}/jobs/${job.id}`, {
+          headers: { Authorization: `Bearer ${token}` }
+        });
+        job = jobResponse.data;
+      }
+
+      if (job.status !== "completed") {
+        throw new Error(job.error || `Import ${job.status}`);
+      }
+      alert(job.result?.message || "Items imported successfully!");
       fetchItems();
     } catch (error) {
       alert(`Import failed: ${error.response?.data?.detail || error.message}`);
@@ -1195,13 +1256,24 @@ const CreditManagement = () => {
 
   useEffect(() => {
     fetchCustomers();
+    return subscribeLiveFeed({
+      customer: (customer) => {
+        setCustomers((prev) => {
+          const others = prev.filter((c) => c.customer_phone !== customer.customer_phone);
+          if (customer.remaining_balance <= 0) return others;
+          return [...others, customer].sort((a, b) => b.remaining_balance - a.remaining_balance);
+        });
+      }
+    });
   }, []);
 
-  const fetchCustomers = async () => {
+  // fresh reads from the primary, for re-reads right after this client's own write
+  const fetchCustomers = async (fresh = false) => {
     try {
       const token = localStorage.getItem("token");
       const response = await axios.get(`${API}/credits/customers`, {
-        headers: { Authorization: `Bearer ${token}` }
+        headers: { Authorization: `Bearer ${token}` },
+        params: fresh ? { fresh: 1 } : {}
       });
       setCustomers(response.data);
     } catch (error) {
@@ -1243,7 +1315,7 @@ const CreditManagement = () => {
       setPaymentAmount("");
       setPaymentNotes("");
       setShowPaymentModal(false);
-      fetchCustomers();
+      fetchCustomers(true);
       fetchCustomerPayments(selectedCustomer.customer_phone);
       alert("Payment added successfully!");
     } catch (error) {
@@ -1447,6 +1519,17 @@ const App = () => {
     setLoading(false);
   }, []);
 
+  useEffect(() => {
+    if (!user) return;
+    // Today's totals are pushed by the server; other periods only track the outstanding amount
+    const applyTotals = ({ totals }) => {
+      setStats((prev) => (prev.period === "today"
+        ? { ...prev, ...totals }
+        : { ...prev, outstanding_amount: totals.outstanding_amount }));
+    };
+    return subscribeLiveFeed({ snapshot: applyTotals, totals: applyTotals });
+  }, [user]);
+
   const fetchStats = async (period = "today") => {
     try {
       const token = localStorage.getItem("token");
@@ -1507,7 +1590,9 @@ const App = () => {
               <p className="text-sm text-gray-600">Hardware & Electrical Store</p>
             </div>
             <div className="flex items-center space-x-4">
-              <span className="text-sm text-gray-700">Welcome, {user.username}</span>
+              <span className="text-sm text-gray-700">
+                Welcome, {user.username}{user.shop_id ? ` (${user.shop_id})` : ""}
+              </span>
               <button
                 onClick={handleLogout}
                 className="bg-red-600 hover:bg-red-700 text-white px-4 py-2 rounded-md text-sm"